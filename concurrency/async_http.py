@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""Minimal asyncio HTTP/1.1 client (keep-alive, limits, timeouts, retries)."""
+
+import asyncio
+import collections
+import logging
+import random
+import ssl
+import time
+import urllib.parse
+
+
+class HTTPError(Exception):
+    def __init__(self, url, status, reason):
+        super().__init__(f"{url}: HTTP {status} {reason}")
+        self.status = status
+
+
+class Response:
+    def __init__(self, url, version, status, reason, headers):
+        self.url = url
+        self.version = version
+        self.status = status
+        self.reason = reason
+        # Header names lower-cased
+        self.headers = headers
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+class Progress:
+    """Completed/failed counters, reported as completed/sec by report()."""
+
+    def __init__(self, total=None):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def line(self):
+        elapsed = time.perf_counter() - self.start
+        total = f"/{self.total:,}" if self.total else ""
+        return (
+            f"{self.completed:,}{total} done ({self.completed / elapsed:,.0f}/s)"
+            f" | {self.failed:,} failed"
+        )
+
+    async def report(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            logging.info(self.line())
+
+
+class AsyncHTTPClient:
+    """GETs over asyncio.open_connection with pooled keep-alive connections.
+
+    concurrency bounds requests in flight overall, per_host bounds them (and
+    so the open connections) per host. Failed attempts (connection errors,
+    timeouts, 429/5xx) are retried with exponential backoff and jitter.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self, concurrency=1000, per_host=8, timeout=30.0, retries=3, backoff=0.5
+    ):
+        self.limit = asyncio.Semaphore(concurrency)
+        self.per_host = per_host
+        self.host_limits = {}
+        self.idle = collections.defaultdict(list)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.ssl_context = ssl.create_default_context()
+        self.connections_opened = 0
+        self.responses = 0
+
+    async def close(self):
+        for conns in self.idle.values():
+            for reader, writer in conns:
+                writer.close()
+        self.idle.clear()
+
+    async def get(self, url, sink, headers=None):
+        """GET url, passing each body chunk to sink(); returns the Response.
+
+        sink(response, None) starts each attempt's body, so a retried attempt
+        can restart its output (e.g. truncate the file) before its chunks.
+        """
+        parts = urllib.parse.urlsplit(url)
+        https = parts.scheme == "https"
+        port = parts.port or (443 if https else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        host_limit = self.host_limits.setdefault(
+            key, asyncio.Semaphore(self.per_host)
+        )
+
+        async with self.limit, host_limit:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        response = await self._request(key, path, headers, sink)
+                    if response.status not in self.RETRY_STATUSES:
+                        return response
+                    error = HTTPError(url, response.status, response.reason)
+                except (OSError, asyncio.IncompleteReadError, TimeoutError) as e:
+                    error = e
+                if attempt < self.retries:
+                    delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                    logging.warning(f"{url}: {error!r}, retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+            raise error
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        while self.idle[key]:
+            reader, writer = self.idle[key].pop()
+            # Server closed it while idle
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        ssl_context = self.ssl_context if scheme == "https" else None
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+        self.connections_opened += 1
+        return reader, writer, False
+
+    async def _request(self, key, path, headers, sink):
+        scheme, host, port = key
+        lines = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {host}" if port in (80, 443) else f"Host: {host}:{port}",
+            "User-Agent: py_notes",
+            "Accept-Encoding: identity",
+        ]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        reader, writer, reused = await self._connect(key)
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line and reused:
+                # Stale keep-alive connection: one free retry on a new one
+                writer.close()
+                reader, writer, reused = await self._connect(key)
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+            response = await self._read_head(status_line, reader, key, path)
+            await self._read_body(response, reader, sink)
+        except BaseException:
+            writer.close()
+            raise
+        self.responses += 1
+        if response.keep_alive:
+            self.idle[key].append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def _read_head(self, status_line, reader, key, path):
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        version, status, *reason = status_line.decode("latin-1").split(None, 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = f"{key[0]}://{key[1]}:{key[2]}{path}"
+        reason = reason[0].strip() if reason else ""
+        return Response(url, version, int(status), reason, headers)
+
+    async def _read_body(self, response, reader, sink, chunk_size=65536):
+        sink(response, None)
+        if response.status in (204, 304) or 100 <= response.status < 200:
+            return
+        if response.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Trailers, then the blank line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                sink(response, await reader.readexactly(size))
+                await reader.readexactly(2)
+        elif "content-length" in response.headers:
+            remaining = int(response.headers["content-length"])
+            while remaining:
+                chunk = await reader.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                sink(response, chunk)
+                remaining -= len(chunk)
+        else:
+            # Body ends when the server closes the connection
+            response.headers["connection"] = "close"
+            while chunk := await reader.read(chunk_size):
+                sink(response, chunk)
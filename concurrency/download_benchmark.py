@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""Times download_urls.py's modes against a local stand-in server."""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+
+from download_urls import (
+    MB,
+    no_threading,
+    with_asyncio,
+    with_segments,
+    with_thread_pool,
+    with_threading,
+)
+from file_server import make_files, serve
+from scheduler import Job
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--files", help="number of files to serve", default=2000, type=int
+    )
+    parser.add_argument(
+        "-s", "--size", help="size of each file (bytes)", default=1024, type=int
+    )
+    parser.add_argument(
+        "-w", "--workers", help="threads for the pool", default=16, type=int
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="requests in flight for asyncio (and threads for --memory)",
+        default=1000,
+        type=int,
+    )
+    parser.add_argument(
+        "-l",
+        "--large",
+        help="also time one file of this size (MB), streamed vs segmented",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--segments", help="ranges for the segmented download", default=8, type=int
+    )
+    parser.add_argument(
+        "--memory",
+        help="compare peak RSS of the pool and asyncio at --concurrency",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--threading",
+        help="also time one-thread-per-URL (thread per file!)",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    # download() logs every URL at INFO: only warnings keep timings readable
+    format = "%(levelname)-5s | %(message)s"
+    logging.basicConfig(format=format, level=logging.WARNING)
+    return args
+
+
+def peak_rss(func, *args):
+    # Runs func in a forked child; returns the child's peak RSS (MB). The
+    # child starts from the parent's footprint, so compare against a no-op.
+    reader, writer = multiprocessing.Pipe(duplex=False)
+
+    def child():
+        func(*args)
+        writer.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+    process = multiprocessing.get_context("fork").Process(target=child)
+    process.start()
+    rss = reader.recv()
+    process.join()
+    return rss
+
+
+def main():
+    args = cli()
+    with tempfile.TemporaryDirectory() as served, tempfile.TemporaryDirectory(
+    ) as out:
+        names = make_files(served, args.files, args.size)
+        server = serve(served)
+        host, port = server.server_address
+        netloc = f"{host}:{port}"
+        jobs = [Job(f"http://{netloc}/{name}", netloc, name) for name in names]
+
+        for pooled in (False, True):
+            print(f"--- {'pooled sessions' if pooled else 'bare requests.get'} ---")
+            no_threading(jobs, out, pooled=pooled)
+            with_thread_pool(jobs, out, args.workers, pooled=pooled)
+            if args.threading:
+                with_threading(jobs, out, pooled=pooled)
+        print(f"--- asyncio, {args.concurrency} in flight ---")
+        with_asyncio(jobs, out, args.concurrency, args.concurrency)
+        assert len(os.listdir(out)) == args.files
+
+        if args.memory:
+            n = args.concurrency
+            print(f"--- peak RSS, {n} threads vs {n} in flight ---")
+            baseline = peak_rss(lambda: None)
+            pool = peak_rss(with_thread_pool, jobs, out, n)
+            aio = peak_rss(with_asyncio, jobs, out, n, n)
+            print(f"baseline: {baseline:.1f} MB")
+            print(f"thread pool: {pool:.1f} MB (+{pool - baseline:.1f})")
+            print(f"asyncio: {aio:.1f} MB (+{aio - baseline:.1f})")
+
+        if args.large:
+            print(f"--- one {args.large} MB file ---")
+            os.makedirs(os.path.join(served, "large"))
+            name = make_files(os.path.join(served, "large"), 1, args.large * MB)[0]
+            job = Job(f"http://{netloc}/large/{name}", netloc, name)
+            no_threading([job], out)
+            with_segments([job], out, args.segments)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""On-disk HTTP cache for download_urls.py (validators, resume, LRU size cap)."""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+MB = 1024 * 1024
+# Lengths and ranges must be of the bytes as stored: with requests' default
+# gzip/deflate they would be of the compressed bytes, while iter_content()
+# returns decompressed ones
+IDENTITY = {"Accept-Encoding": "identity"}
+CHUNK_SIZE = 64 * 1024
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "py_notes",
+    "downloads",
+)
+
+
+def expected_length(response):
+    # None if unknown, or if Content-Length counts encoded bytes
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    length = response.headers.get("Content-Length")
+    return int(length) if length else None
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.resumed = 0
+        self.evicted = 0
+        self.downloaded = 0
+        self.served = 0
+
+    def __str__(self):
+        lookups = self.hits + self.misses + self.resumed
+        rate = self.hits / lookups if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses, {self.resumed} resumed"
+            f" ({rate:.0%} hit rate) | {self.downloaded / MB:,.1f} MB downloaded,"
+            f" {self.served / MB:,.1f} MB served | {self.evicted} evicted"
+        )
+
+
+class DownloadCache:
+    """Bodies keyed by URL plus their ETag/Last-Modified, in a directory.
+
+    fetch() revalidates a cached body with a conditional GET (304: nothing
+    is transferred), resumes an interrupted one with Range/If-Range, and
+    otherwise downloads it. Complete bodies beyond max_bytes are evicted,
+    least recently used first. Safe to share between threads.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=1024 * MB):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, etag TEXT,"
+            " last_modified TEXT, size INTEGER, complete INTEGER, last_used REAL)"
+        )
+        (self.total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries WHERE complete"
+        ).fetchone()
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def _query(self, sql, *params):
+        with self.lock:
+            return self.db.execute(sql, params).fetchone()
+
+    def _count(self, name, n=1):
+        with self.lock:
+            setattr(self.stats, name, getattr(self.stats, name) + n)
+
+    def fetch(self, get, url, dest):
+        """Brings dest up to date with url; get is requests.get or a Session's."""
+        body = self._path(url)
+        part = body + ".part"
+        entry = self._query(
+            "SELECT etag, last_modified, size, complete FROM entries WHERE url = ?",
+            url,
+        )
+        headers = dict(IDENTITY)
+        offset = 0
+        if entry and entry[3] and os.path.exists(body):
+            etag, last_modified, _, _ = entry
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        elif entry and os.path.exists(part) and (entry[0] or entry[1]):
+            etag, last_modified, size, _ = entry
+            offset = os.path.getsize(part)
+            if offset == size:
+                # Interrupted after the last byte: nothing left to fetch
+                self._store(url, part, body)
+                self._copy_out(url, body, dest)
+                return
+            if size is None or offset < size:
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = etag or last_modified
+            else:
+                offset = 0
+
+        with get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                self._count("hits")
+            else:
+                content_range = response.headers.get("Content-Range", "")
+                resumed = (
+                    response.status_code == 206
+                    and "Range" in headers
+                    and content_range.startswith(f"bytes {offset}-")
+                )
+                if response.status_code == 206 and (
+                    not resumed or expected_length(response) is None
+                ):
+                    # Not the rest of our bytes, or encoded ones: start over
+                    # next time
+                    if os.path.exists(part):
+                        os.remove(part)
+                    raise ValueError(
+                        f"{url}: can't resume at {offset:,} ({content_range!r},"
+                        f" {response.headers.get('Content-Encoding')!r})"
+                    )
+                if not resumed:
+                    response.raise_for_status()
+                    offset = 0
+                    with self.lock:
+                        # A changed body replaces the cached one
+                        old = self.db.execute(
+                            "SELECT size FROM entries WHERE url = ? AND complete",
+                            (url,),
+                        ).fetchone()
+                        self.total -= old[0] if old else 0
+                        self.db.execute(
+                            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, 0, ?)",
+                            (
+                                url,
+                                response.headers.get("ETag"),
+                                response.headers.get("Last-Modified"),
+                                expected_length(response),
+                                time.time(),
+                            ),
+                        )
+                self._count("resumed" if resumed else "misses")
+                # An interrupted run leaves the '.part' (and its entry) to resume
+                with open(part, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        self._count("downloaded", len(chunk))
+                expected = expected_length(response)
+                actual = os.path.getsize(part)
+                if expected is not None and actual != offset + expected:
+                    # Short: the entry stays incomplete, to resume. Long: no
+                    # way to tell which bytes are wrong
+                    if actual > offset + expected:
+                        os.remove(part)
+                    raise ValueError(
+                        f"{url}: got {actual:,} bytes, expected {offset + expected:,}"
+                    )
+                self._store(url, part, body)
+        self._copy_out(url, body, dest)
+
+    def _store(self, url, part, body):
+        # '.part' becomes the body; the recorded size is what is on disk
+        os.replace(part, body)
+        size = os.path.getsize(body)
+        with self.lock:
+            self.db.execute(
+                "UPDATE entries SET size = ?, complete = 1 WHERE url = ?", (size, url)
+            )
+            self.total += size
+
+    def _copy_out(self, url, body, dest):
+        with self.lock:
+            self.db.execute(
+                "UPDATE entries SET last_used = ? WHERE url = ?", (time.time(), url)
+            )
+        # Never leaves a truncated file under dest's name
+        shutil.copyfile(body, dest + ".part")
+        os.replace(dest + ".part", dest)
+        self._count("served", os.path.getsize(dest))
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            while self.total > self.max_bytes:
+                row = self.db.execute(
+                    "SELECT url, size FROM entries WHERE complete"
+                    " ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                url, size = row
+                try:
+                    os.remove(self._path(url))
+                except FileNotFoundError:
+                    pass
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self.total -= size
+                self.stats.evicted += 1
+                logging.debug(f"Evicted {url} ({size:,} bytes)")
+
+    def log_stats(self):
+        print(f"Cache: {self.stats} | {self.total / MB:,.1f} MB on disk")
+
+    def close(self):
+        self.db.close()
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 
-"""Downloads content from user-specified URLs (threading optional)."""
+"""Downloads content from user-specified URLs (threading or asyncio optional)."""
 
 import argparse
+import asyncio
+import base64
+import collections
 import concurrent.futures
+import hashlib
 import logging
 import os
-import re
 import requests
+import requests.adapters
 import threading
 import time
 
+from async_http import AsyncHTTPClient, HTTPError, Progress
+from download_cache import CACHE_DIR, IDENTITY, DownloadCache, expected_length
+from scheduler import Scheduler, SeenStore, iter_jobs, iter_urls
+
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
 
 def cli():
     # User may pass URLs through command line and/or a file
@@ -29,11 +40,82 @@ def cli():
         help="Use ThreadPool from concurrent.futures module",
         action="store_true",
     )
+    thread_method.add_argument(
+        "--asyncio", help="Use the asyncio HTTP client", action="store_true"
+    )
+    thread_method.add_argument(
+        "--segmented",
+        help="Fetch each file as concurrent byte ranges (if the server allows)",
+        action="store_true",
+    )
+    thread_method.add_argument(
+        "--schedule",
+        help="ThreadPool fed by the scheduler (dedupe, fair per-host limits)",
+        action="store_true",
+    )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Threads for --pool and --schedule",
+        default=16,
+        type=int,
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="Requests in flight for --asyncio",
+        default=1000,
+        type=int,
+    )
+    parser.add_argument(
+        "--per-host",
+        help="Requests in flight per host for --asyncio and --schedule",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--timeout", help="Seconds per --asyncio attempt", default=30.0, type=float
+    )
+    parser.add_argument(
+        "--retries", help="Retries per URL for --asyncio", default=3, type=int
+    )
+    parser.add_argument(
+        "--segments", help="Ranges per file for --segmented", default=8, type=int
+    )
+    parser.add_argument(
+        "--rate",
+        help="Requests/sec per host for --schedule (0: unlimited)",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--burst",
+        help="Token-bucket burst per host for --schedule",
+        default=10,
+        type=int,
+    )
+    parser.add_argument(
+        "--lookahead",
+        help="URLs buffered ahead for --schedule",
+        default=10000,
+        type=int,
+    )
+    parser.add_argument(
+        "--cache",
+        help="Revalidate/resume through an on-disk cache (default dir: %(const)s)",
+        nargs="?",
+        const=CACHE_DIR,
+    )
+    parser.add_argument(
+        "--cache-size", help="Cache size cap (MB)", default=1024, type=int
+    )
     parser.add_argument(
         "--quiet", help="Only show warnings and errors", action="store_true"
     )
     args = parser.parse_args()
+    if args.cache and (args.asyncio or args.segmented):
+        parser.error("--cache works with the requests modes only")
 
     format = "%(levelname)-5s | %(message)s"
     level = logging.WARNING if args.quiet else logging.INFO
@@ -51,57 +133,417 @@ def timer(func):
     return wrapper
 
 
-def download(url, dir=""):
+class SessionPool:
+    """Per-thread requests.Session objects sharing one HTTPAdapter.
+
+    The adapter owns the urllib3 connection pools (thread-safe, keep-alive),
+    so every thread reuses the same open connections; a Session itself
+    (cookies etc.) is never shared between threads.
+    """
+
+    def __init__(self, n_threads):
+        # pool_maxsize: one connection per thread to each host; pool_block
+        # makes extra threads wait for one instead of opening throwaways
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max(10, n_threads),
+            pool_maxsize=n_threads,
+            pool_block=True,
+        )
+        self.local = threading.local()
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            self.local.session = session
+        return session
+
+    def stats(self):
+        # {host: (requests, connections opened)} from the urllib3 pools
+        pools = self.adapter.poolmanager.pools
+        stats = {}
+        for key in pools.keys():
+            pool = pools[key]
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = (
+                pool.num_requests,
+                pool.num_connections,
+            )
+        return stats
+
+    def log_stats(self):
+        for host, (n_requests, n_connections) in sorted(self.stats().items()):
+            print(
+                f"{host}: {n_requests} requests over {n_connections} connections"
+                f" ({n_requests - n_connections} reused)"
+            )
+
+    def close(self):
+        self.adapter.close()
+
+
+def url_filename(url):
+    return url.split("/")[-1] if url.split("/")[-1] else url.split("/")[-2]
+
+
+def download(url, dir="", sessions=None, cache=None, filename=None):
     logging.info(f"Downloading from {url}")
-    url_bytes = requests.get(url).content
-    url_name = url.split("/")[-1] if url.split("/")[-1] else url.split("/")[-2]
-    with open(os.path.join(dir, url_name), "wb") as f:
-        f.write(url_bytes)
+    get = sessions.session().get if sessions else requests.get
+    url_name = filename or url_filename(url)
+    path = os.path.join(dir, url_name)
+    if cache:
+        cache.fetch(get, url, path)
         logging.info(f"{url_name} was downloaded")
+        return
+    # Streamed: only one chunk of the body is in memory at a time, and only
+    # a complete 2xx body (as long as its Content-Length) ever gets url_name
+    with get(url, headers=IDENTITY, stream=True) as response:
+        response.raise_for_status()
+        expected = expected_length(response)
+        written = 0
+        try:
+            with open(path + ".part", "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            if expected is not None and written != expected:
+                raise ValueError(f"{url}: got {written:,} bytes, expected {expected:,}")
+        except BaseException:
+            os.remove(path + ".part")
+            raise
+    os.replace(path + ".part", path)
+    logging.info(f"{url_name} was downloaded")
+
+
+def logged(func, url, *args):
+    # One URL's failure is logged, never the end of the run
+    try:
+        func(url, *args)
+    except (OSError, ValueError) as e:
+        logging.error(f"{url} failed: {e!r}")
+        return False
+    return True
+
+
+def _preallocate(fd, size):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def _fetch_range(sessions, url, fd, start, end):
+    # Streams bytes start..end (inclusive) to the same offsets of fd
+    headers = {"Range": f"bytes={start}-{end}", **IDENTITY}
+    with sessions.session().get(url, headers=headers, stream=True) as response:
+        content_range = response.headers.get("Content-Range", "")
+        if (
+            response.status_code != 206
+            or not content_range.startswith(f"bytes {start}-{end}/")
+            or response.headers.get("Content-Encoding", "identity") != "identity"
+        ):
+            raise ValueError(
+                f"{url}: range {start}-{end} not honoured"
+                f" ({response.status_code} {content_range!r})"
+            )
+        offset = start
+        for chunk in response.iter_content(CHUNK_SIZE):
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+    if offset != end + 1:
+        raise ValueError(f"{url}: range {start}-{end} ended at {offset - 1}")
+    return offset - start
+
+
+def _expected_sha256(digest_header):
+    # RFC 3230 "Digest: sha-256=<base64>, ..." (None if absent)
+    for item in (digest_header or "").split(","):
+        algorithm, _, value = item.strip().partition("=")
+        if algorithm.lower() == "sha-256":
+            return base64.b64decode(value)
+    return None
+
+
+def verify(path, size, digest_header):
+    actual = os.path.getsize(path)
+    if actual != size:
+        raise ValueError(f"{path}: {actual:,} bytes, expected {size:,}")
+    with open(path, "rb") as f:
+        sha256 = hashlib.file_digest(f, "sha256").digest()
+    expected = _expected_sha256(digest_header)
+    if expected is None:
+        logging.warning(f"{path}: no Digest to check against (sha256 {sha256.hex()})")
+    elif sha256 != expected:
+        raise ValueError(f"{path}: sha256 {sha256.hex()}, expected {expected.hex()}")
+
+
+def download_segmented(
+    url, dir="", sessions=None, segments=8, min_size=MB, filename=None
+):
+    # One file as `segments` concurrent Range requests pwrite()n into a
+    # preallocated '.part' file; renamed once its length and checksum match
+    sessions = sessions or SessionPool(segments)
+    head = sessions.session().head(url, allow_redirects=True, headers=IDENTITY)
+    size = int(head.headers.get("Content-Length", 0))
+    # A HEAD error (some servers answer 403/405) says nothing of the GET:
+    # download() will raise if that fails too
+    if (
+        not head.ok
+        or head.headers.get("Accept-Ranges") != "bytes"
+        or head.headers.get("Content-Encoding", "identity") != "identity"
+        or size < min_size
+    ):
+        return download(url, dir, sessions, filename=filename)
+
+    logging.info(f"Downloading from {url} in {segments} ranges")
+    path = os.path.join(dir, filename or url_filename(url))
+    part = path + ".part"
+    segment = -(-size // segments)
+    ranges = [
+        (start, min(start + segment, size) - 1) for start in range(0, size, segment)
+    ]
+    fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            _preallocate(fd, size)
+            with concurrent.futures.ThreadPoolExecutor(segments) as executor:
+                futures = [
+                    executor.submit(_fetch_range, sessions, url, fd, start, end)
+                    for start, end in ranges
+                ]
+                written = sum(future.result() for future in futures)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if written != size:
+            raise ValueError(f"{url}: got {written:,} bytes, expected {size:,}")
+        verify(part, size, head.headers.get("Digest"))
+    except BaseException:
+        os.remove(part)
+        raise
+    os.replace(part, path)
+    logging.info(f"{os.path.basename(path)} was downloaded and verified")
 
 
 @timer
-def no_threading(urls, dir):
-    for url in urls:
-        download(url, dir)
+def no_threading(jobs, dir, pooled=True, cache=None):
+    sessions = SessionPool(1) if pooled else None
+    for job in jobs:
+        logged(download, job.url, dir, sessions, cache, job.filename)
+    if sessions:
+        sessions.log_stats()
+        sessions.close()
 
 
 @timer
-def with_threading(urls, dir):
+def with_threading(jobs, dir, pooled=True, cache=None):
+    sessions = SessionPool(len(jobs)) if pooled else None
     threads = []
-    for url in urls:
-        t = threading.Thread(target=download, args=[url, dir])
+    for job in jobs:
+        t = threading.Thread(
+            target=logged,
+            args=[download, job.url, dir, sessions, cache, job.filename],
+        )
         t.start()
         threads.append(t)
     for thread in threads:
         thread.join()
+    if sessions:
+        sessions.log_stats()
+        sessions.close()
+
+
+@timer
+def with_thread_pool(jobs, dir, workers=16, pooled=True, cache=None):
+    sessions = SessionPool(workers) if pooled else None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Consumed, so nothing a download raised goes unseen
+        ok = list(
+            executor.map(
+                logged,
+                [download] * len(jobs),
+                [job.url for job in jobs],
+                [dir] * len(jobs),
+                [sessions] * len(jobs),
+                [cache] * len(jobs),
+                [job.filename for job in jobs],
+            )
+        )
+    if not all(ok):
+        logging.warning(f"{ok.count(False)} of {len(jobs)} downloads failed")
+    if sessions:
+        sessions.log_stats()
+        sessions.close()
+
+
+@timer
+def with_scheduler(scheduler, dir, workers=16, cache=None):
+    # The scheduler only hands out a job when a worker is free for it, so
+    # the executor's queue never fills up with one host's URLs
+    sessions = SessionPool(workers)
+
+    def run(job):
+        try:
+            logged(download, job.url, dir, sessions, cache, job.filename)
+        finally:
+            scheduler.done(job)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for job in scheduler:
+            executor.submit(run, job)
+    scheduler.log_stats()
+    sessions.log_stats()
+    sessions.close()
+
+
+@timer
+def with_segments(jobs, dir, segments=8):
+    sessions = SessionPool(segments)
+    for job in jobs:
+        logged(
+            download_segmented, job.url, dir, sessions, segments, MB, job.filename
+        )
+    sessions.log_stats()
+    sessions.close()
+
+
+async def download_async(client, url, dir, progress, filename=None):
+    logging.debug(f"Downloading from {url}")
+    url_name = filename or url_filename(url)
+    path = os.path.join(dir, url_name)
+    f = None
+    done = False
+
+    def sink(response, chunk):
+        # Opened on the first response, not while queued behind the limits
+        nonlocal f
+        if chunk is None:
+            f = f or open(path + ".part", "wb")
+            f.seek(0)
+            f.truncate()
+        else:
+            f.write(chunk)
+
+    # As in download(), which now checks status and length too: only a
+    # complete 200 body (the client reads exactly its Content-Length or
+    # chunks) is renamed to url_name; anything else removes the '.part'
+    try:
+        try:
+            response = await client.get(url, sink)
+        finally:
+            if f:
+                f.close()
+        if response.status != 200:
+            raise HTTPError(url, response.status, response.reason)
+        os.replace(path + ".part", path)
+        done = True
+    except (OSError, asyncio.IncompleteReadError, TimeoutError, HTTPError) as e:
+        progress.failed += 1
+        logging.error(f"{url} failed: {e!r}")
+    else:
+        progress.completed += 1
+        logging.debug(f"{url_name} was downloaded")
+    finally:
+        if f and not done:
+            try:
+                os.remove(path + ".part")
+            except FileNotFoundError:
+                pass
+
+
+async def download_all(jobs, dir, concurrency, per_host, timeout, retries):
+    client = AsyncHTTPClient(concurrency, per_host, timeout, retries)
+    progress = Progress(len(jobs))
+    reporter = asyncio.create_task(progress.report())
+    # Tasks are created as slots free up: memory stays O(concurrency)
+    pending = set()
+    for job in jobs:
+        if len(pending) >= concurrency:
+            _, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+        pending.add(
+            asyncio.create_task(
+                download_async(client, job.url, dir, progress, job.filename)
+            )
+        )
+    if pending:
+        await asyncio.wait(pending)
+    reporter.cancel()
+    await client.close()
+    logging.info(progress.line())
+    n_responses, n_connections = client.responses, client.connections_opened
+    print(
+        f"{n_responses} responses over {n_connections} connections"
+        f" ({n_responses - n_connections} reused)"
+    )
 
 
 @timer
-def with_thread_pool(urls, dir):
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.map(download, urls, [dir] * len(urls))
+def with_asyncio(jobs, dir, concurrency=1000, per_host=8, timeout=30.0, retries=3):
+    asyncio.run(download_all(jobs, dir, concurrency, per_host, timeout, retries))
+
+
+def plan(urls):
+    # Every mode but --schedule gets its jobs up front: normalized, deduped
+    # and uniquely named, as the scheduler does as it goes
+    seen = SeenStore()
+    stats = collections.Counter()
+    jobs = list(iter_jobs(urls, url_filename, seen, stats))
+    seen.close()
+    print(
+        f"URLs: {stats['read']} read, {len(jobs)} to download,"
+        f" {stats['duplicates']} duplicates, {stats['invalid']} invalid,"
+        f" {stats['renamed']} renamed"
+    )
+    return jobs
 
 
 def main():
     args = cli()
-    urls = args.url
-    urls_file = args.file
-
-    url_list = []
-    if urls:
-        url_list += urls
-    if urls_file:
-        with open(urls_file, "r") as f:
-            url_list += [url for url in re.split("[,;\n ]+", f.read()) if url]
-
-    if args.threading or args.pool:
-        if args.threading:
-            with_threading(url_list, args.dir)
-        else:
-            with_thread_pool(url_list, args.dir)
+    # Command-line URLs, then the file's (read lazily)
+    urls = iter_urls(args.url or [], args.file)
+    cache = None
+    if args.cache:
+        cache = DownloadCache(args.cache, args.cache_size * MB)
+
+    if args.schedule:
+        scheduler = Scheduler(
+            urls,
+            url_filename,
+            args.rate,
+            args.burst,
+            args.per_host,
+            args.workers,
+            args.lookahead,
+        )
+        with_scheduler(scheduler, args.dir, args.workers, cache)
+        scheduler.close()
+    elif args.asyncio:
+        with_asyncio(
+            plan(urls),
+            args.dir,
+            args.concurrency,
+            args.per_host,
+            args.timeout,
+            args.retries,
+        )
+    elif args.segmented:
+        with_segments(plan(urls), args.dir, args.segments)
+    elif args.threading:
+        with_threading(plan(urls), args.dir, cache=cache)
+    elif args.pool:
+        with_thread_pool(plan(urls), args.dir, args.workers, cache=cache)
     else:
-        no_threading(url_list, args.dir)
+        no_threading(plan(urls), args.dir, cache=cache)
+
+    if cache:
+        cache.log_stats()
+        cache.close()
 
 
 if __name__ == "__main__":
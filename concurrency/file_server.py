@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""Local stand-in HTTP/1.1 server (keep-alive, Range, ETag) for download tests."""
+
+import argparse
+import base64
+import functools
+import hashlib
+import http.server
+import logging
+import os
+import re
+import threading
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir", help="directory to serve")
+    parser.add_argument("-p", "--port", help="port to bind", default=8000, type=int)
+    parser.add_argument(
+        "-n", "--files", help="generate this many files first", default=0, type=int
+    )
+    parser.add_argument(
+        "-s", "--size", help="size of generated files (bytes)", default=1024, type=int
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1: connections stay open between requests (Content-Length is set)
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes: without TCP_NODELAY the body
+    # waits on the client's delayed ACK (~40 ms per keep-alive request)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} | {format % args}")
+
+    def send_head(self):
+        # Files get Accept-Ranges, an ETag and a Digest; If-None-Match is
+        # answered with 304 and single byte ranges (subject to If-Range)
+        # with 206. Everything else is SimpleHTTPRequestHandler's
+        self.extra_headers = {}
+        self.remaining = None
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        st = os.stat(path)
+        size = st.st_size
+        etag = f'"{size:x}-{st.st_mtime_ns:x}"'
+        self.extra_headers = {"Accept-Ranges": "bytes", "ETag": etag}
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or etag in [tag.strip() for tag in if_none_match.split(",")]
+        ):
+            self.send_response(http.HTTPStatus.NOT_MODIFIED)
+            self.end_headers()
+            return None
+        self.extra_headers["Digest"] = f"sha-256={file_digest(path)}"
+
+        last_modified = self.date_time_string(st.st_mtime)
+        if_range = self.headers.get("If-Range")
+        byte_range = None
+        if if_range is None or if_range.strip() in (etag, last_modified):
+            byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is None:
+            return super().send_head()
+        if byte_range is False:
+            self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        start, end = byte_range
+        f = open(path, "rb")
+        f.seek(start)
+        self.remaining = end - start + 1
+        self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(self.remaining))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        return f
+
+    def end_headers(self):
+        for name, value in getattr(self, "extra_headers", {}).items():
+            self.send_header(name, value)
+        super().end_headers()
+
+    def copyfile(self, source, outputfile):
+        if self.remaining is None:
+            return super().copyfile(source, outputfile)
+        while self.remaining:
+            buf = source.read(min(64 * 1024, self.remaining))
+            if not buf:
+                break
+            outputfile.write(buf)
+            self.remaining -= len(buf)
+
+
+def parse_range(header, size):
+    # (start, end) inclusive for one satisfiable range, False if it can't be
+    # satisfied, None to ignore it (absent, malformed or multiple ranges)
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+        return (start, end) if int(last) and size else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def file_digest(path):
+    # Base64 SHA-256 (RFC 3230 Digest), cached until the file changes
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = base64.b64encode(hashlib.file_digest(f, "sha256").digest())
+        digest = digest.decode("ascii")
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+class Server(http.server.ThreadingHTTPServer):
+    # listen() backlog (default 5): room for a burst of concurrent connects
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_files(directory, n_files, size):
+    # file00000.bin, file00001.bin, ... (returns their names)
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for i in range(n_files):
+        name = f"file{i:05}.bin"
+        path = os.path.join(directory, name)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+        names.append(name)
+    return names
+
+
+def serve(directory, port=0, host="127.0.0.1"):
+    # Starts the server on a daemon thread; returns it (server.server_address)
+    handler = functools.partial(Handler, directory=directory)
+    server = Server((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    args = cli()
+    if args.files:
+        make_files(args.dir, args.files, args.size)
+    server = serve(args.dir, args.port, host="0.0.0.0")
+    logging.info(f"Serving {args.dir} on port {server.server_address[1]}...")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
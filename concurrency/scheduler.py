@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""Streams, dedupes and fairly interleaves URLs for download_urls.py."""
+
+import collections
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+SEPARATORS = re.compile("[,;\n ]+")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+Job = collections.namedtuple("Job", "url host filename")
+
+
+def iter_urls(urls=(), path=None):
+    # Command-line URLs, then the file's, read one line at a time
+    yield from urls
+    if path:
+        with open(path, "r") as f:
+            for line in f:
+                yield from (url for url in SEPARATORS.split(line) if url)
+
+
+def normalize_url(url):
+    # Lower-case scheme/host, no default port or fragment, upper-case
+    # %-escapes; None if it isn't an http(s) URL
+    try:
+        parts = urllib.parse.urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc += f":{port}"
+    path = parts.path or "/"
+    if "%" in path:
+        path = re.sub("%[0-9a-f]{2}", lambda m: m.group().upper(), path)
+    return urllib.parse.urlunsplit((scheme, netloc, path, parts.query, ""))
+
+
+def iter_jobs(urls, filename, seen, stats):
+    # Jobs for urls: normalized, each URL once and under a file name of its
+    # own (filename(url), made unique in seen); counts go to stats
+    for raw in urls:
+        stats["read"] += 1
+        url = normalize_url(raw)
+        if url is None:
+            stats["invalid"] += 1
+            logging.warning(f"Skipping invalid URL {raw!r}")
+            continue
+        if not seen.add(url):
+            stats["duplicates"] += 1
+            continue
+        name = filename(url)
+        unique = seen.unique_name(name)
+        if unique != name:
+            stats["renamed"] += 1
+        # Normalized: scheme://netloc/...
+        yield Job(url, url.split("/", 3)[2], unique)
+
+
+class SeenStore:
+    """URLs already scheduled and file names already handed out, on disk.
+
+    An empty sqlite filename is a private temporary database: memory stays
+    flat however many URLs go through it.
+    """
+
+    def __init__(self, path=""):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, next INTEGER)"
+        )
+
+    def add(self, url):
+        # True the first time url is seen
+        cursor = self.db.execute("INSERT OR IGNORE INTO seen VALUES (?)", (url,))
+        return cursor.rowcount == 1
+
+    def unique_name(self, name):
+        # name, or name-1.ext, name-2.ext, ... if already handed out
+        row = self.db.execute("SELECT next FROM names WHERE name = ?", (name,))
+        row = row.fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO names VALUES (?, 1)", (name,))
+            return name
+        stem, ext = os.path.splitext(name)
+        n = row[0]
+        while True:
+            candidate = f"{stem}-{n}{ext}"
+            n += 1
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO names VALUES (?, 1)", (candidate,)
+            )
+            if cursor.rowcount == 1:
+                break
+        self.db.execute("UPDATE names SET next = ? WHERE name = ?", (n, name))
+        return candidate
+
+    def close(self):
+        self.db.close()
+
+
+class TokenBucket:
+    # rate tokens/sec up to burst; rate 0 means unlimited
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def ready(self):
+        if not self.rate:
+            return True
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def wait_time(self):
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate else 0.0
+
+
+class Scheduler:
+    """Iterates over Jobs: deduped, uniquely named, hosts round-robin.
+
+    A job for a host is only handed out while the host has a token (rate
+    per second, up to burst) and fewer than per_host jobs in flight, and
+    only while fewer than max_in_flight jobs are in flight overall; done()
+    must be called for every job. At most lookahead URLs are buffered.
+    """
+
+    def __init__(
+        self,
+        urls,
+        filename,
+        rate=0.0,
+        burst=10,
+        per_host=8,
+        max_in_flight=16,
+        lookahead=10000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.per_host = per_host
+        self.max_in_flight = max_in_flight
+        self.lookahead = lookahead
+        self.seen = SeenStore()
+        self.stats = collections.Counter()
+        self.jobs = iter_jobs(urls, filename, self.seen, self.stats)
+        self.queues = collections.OrderedDict()
+        self.buckets = {}
+        self.host_in_flight = collections.Counter()
+        self.in_flight = 0
+        self.buffered = 0
+        self.exhausted = False
+        self.cond = threading.Condition()
+
+    def __iter__(self):
+        return self
+
+    def _fill(self):
+        while self.buffered < self.lookahead and not self.exhausted:
+            job = next(self.jobs, None)
+            if job is None:
+                self.exhausted = True
+                break
+            self.queues.setdefault(job.host, collections.deque()).append(job)
+            self.buffered += 1
+
+    def _prune(self):
+        # Forget idle hosts whose bucket has refilled: memory stays bounded
+        for host, bucket in list(self.buckets.items()):
+            busy = host in self.queues or self.host_in_flight[host]
+            bucket.ready()
+            if not busy and bucket.tokens >= bucket.burst:
+                del self.buckets[host]
+
+    def _pick(self):
+        # (job, None), or (None, seconds to wait; None until a done())
+        if len(self.buckets) > 2 * self.lookahead:
+            self._prune()
+        if self.in_flight >= self.max_in_flight:
+            return None, None
+        wait = None
+        for host, queue in self.queues.items():
+            if self.host_in_flight[host] >= self.per_host:
+                continue
+            bucket = self.buckets.setdefault(
+                host, TokenBucket(self.rate, self.burst)
+            )
+            if not bucket.ready():
+                host_wait = bucket.wait_time()
+                wait = host_wait if wait is None else min(wait, host_wait)
+                continue
+            bucket.take()
+            job = queue.popleft()
+            if queue:
+                # Round-robin: this host goes to the back of the line
+                self.queues.move_to_end(host)
+            else:
+                del self.queues[host]
+            return job, None
+        return None, wait
+
+    def __next__(self):
+        with self.cond:
+            while True:
+                self._fill()
+                if not self.queues and self.exhausted:
+                    raise StopIteration
+                job, wait = self._pick()
+                if job:
+                    self.buffered -= 1
+                    self.in_flight += 1
+                    self.host_in_flight[job.host] += 1
+                    self.stats["dispatched"] += 1
+                    return job
+                self.cond.wait(wait)
+
+    def done(self, job):
+        with self.cond:
+            self.in_flight -= 1
+            self.host_in_flight[job.host] -= 1
+            if not self.host_in_flight[job.host]:
+                del self.host_in_flight[job.host]
+            self.cond.notify()
+
+    def log_stats(self):
+        stats = self.stats
+        print(
+            f"Scheduler: {stats['read']} URLs read, {stats['dispatched']} dispatched,"
+            f" {stats['duplicates']} duplicates, {stats['invalid']} invalid,"
+            f" {stats['renamed']} renamed"
+        )
+
+    def close(self):
+        self.seen.close()
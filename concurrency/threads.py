@@ -3,12 +3,33 @@
 # threading for IO-bound processes
 # multiprocessing for CPU-bond processes (parallelism)
 import argparse
+import asyncio
 import concurrent.futures
+import functools
+import itertools
+import json
 import logging
+import queue
+import resource
+import statistics
+import subprocess
+import sys
 import threading
 import time
 
-PROCESSES = 0
+
+class Counter:
+    # Thread- and task-safe replacement for `global n; n += 1; pid = n`
+    def __init__(self):
+        self._count = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return next(self._count)
+
+
+PIDS = Counter()
 
 
 def cli():
@@ -19,6 +40,29 @@ def cli():
     parser.add_argument(
         "-t", "--threads", help="number of threads", required=True, type=int
     )
+    parser.add_argument(
+        "-p",
+        "--pipeline",
+        help="run the fetch -> parse -> write pipeline demo instead",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-a",
+        "--asyncio",
+        help="also run the asyncio versions (unbounded and --limit)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-l", "--limit", help="semaphore size for bounded asyncio", type=int
+    )
+    parser.add_argument(
+        "-c",
+        "--compare",
+        help="threads vs asyncio report at these task counts instead",
+        nargs="+",
+        type=int,
+    )
+    parser.add_argument("--trial", help=argparse.SUPPRESS)
     parser.add_argument(
         "-q", "--quiet", help="only show warnings and errors", action="store_true"
     )
@@ -42,9 +86,7 @@ def timer(func):
 
 
 def sleep_for(seconds):
-    global PROCESSES
-    PROCESSES += 1
-    pid = PROCESSES
+    pid = PIDS.next()
     logging.info(f"pid:{pid:>3}| Sleeping for {seconds} seconds...")
     time.sleep(seconds)
     logging.info(f"pid:{pid:>3}| Done sleeping for {seconds} seconds")
@@ -74,10 +116,8 @@ def with_threading(seconds, n_threads):
         thread_list.append(t)
         seconds += 1
     # Call join() after starting all threads (will wait for thread to finish)
-    # Notice: did not join() last thread, so finishes after main() continues
-    for thread in thread_list[:-1]:
+    for thread in thread_list:
         thread.join()
-    # Last thread will not appear in results (still executing).
     print(f"pid in order of completion: {results}")
 
 
@@ -104,11 +144,313 @@ def with_thread_pool(seconds, n_threads):
         print(f"pid in order of completion: {results}")
 
 
+async def async_sleep_for(seconds):
+    pid = PIDS.next()
+    logging.info(f"pid:{pid:>3}| Sleeping for {seconds} seconds...")
+    await asyncio.sleep(seconds)
+    logging.info(f"pid:{pid:>3}| Done sleeping for {seconds} seconds")
+    return pid
+
+
+def show_order(results, limit=20):
+    if len(results) > limit:
+        return f"{results[:limit]} ... ({len(results)} total)"
+    return f"{results}"
+
+
+@timer
+def with_asyncio(seconds, n_tasks, limit=None):
+    # Every task sleeps the same `seconds` (100k tasks, not 100k seconds).
+    # limit bounds how many sleep at once, like a pool's max_workers
+    async def fan_out():
+        results = []
+        semaphore = asyncio.Semaphore(limit or n_tasks)
+
+        async def task():
+            async with semaphore:
+                results.append(await async_sleep_for(seconds))
+
+        # TaskGroup: waits for all tasks, cancels the rest if one fails
+        async with asyncio.TaskGroup() as group:
+            for _ in range(n_tasks):
+                group.create_task(task())
+        return results
+
+    results = asyncio.run(fan_out())
+    print(f"pid in order of completion: {show_order(results)}")
+
+
+def run_trial(mode, seconds, n_tasks):
+    # One fan-out of n_tasks sleeps; scheduling latency is from
+    # Thread.start()/create_task() to the task's first line
+    latencies = []
+    start = time.perf_counter()
+    if mode == "threads":
+
+        def task(started):
+            latencies.append(time.perf_counter() - started)
+            time.sleep(seconds)
+
+        threads = []
+        try:
+            for _ in range(n_tasks):
+                thread = threading.Thread(target=task, args=[time.perf_counter()])
+                thread.start()
+                threads.append(thread)
+        except RuntimeError as e:
+            # "can't start new thread": the OS limit was hit
+            return {"error": f"{e} after {len(threads)} threads"}
+        finally:
+            for thread in threads:
+                thread.join()
+    else:
+
+        async def task(started):
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(seconds)
+
+        async def fan_out():
+            async with asyncio.TaskGroup() as group:
+                for _ in range(n_tasks):
+                    group.create_task(task(time.perf_counter()))
+
+        asyncio.run(fan_out())
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "wall_s": wall,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latency_mean_ms": statistics.fmean(latencies) * 1e3,
+        "latency_p99_ms": latencies[int(0.99 * (len(latencies) - 1))] * 1e3,
+        "latency_max_ms": latencies[-1] * 1e3,
+    }
+
+
+def compare(seconds, task_counts):
+    # Each trial in a fresh interpreter: peak RSS is that trial's alone
+    print(
+        f"{'mode':<8}| {'tasks':>7} | {'wall':>7} | {'peak RSS':>9}"
+        f" | {'sched latency mean / p99 / max (ms)':>36}"
+    )
+    for n_tasks in task_counts:
+        for mode in ("threads", "asyncio"):
+            command = [sys.executable, __file__, "-q", "--trial", mode]
+            command += ["-s", str(seconds), "-t", str(n_tasks)]
+            output = subprocess.run(command, capture_output=True, text=True)
+            try:
+                r = json.loads(output.stdout)
+            except ValueError:
+                r = {"error": output.stderr.strip().splitlines()[-1:]}
+            if "error" in r:
+                print(f"{mode:<8}| {n_tasks:>7} | failed: {r['error']}")
+                continue
+            print(
+                f"{mode:<8}| {n_tasks:>7} | {r['wall_s']:>6.2f}s"
+                f" | {r['rss_mb']:>6.1f} MB | {r['latency_mean_ms']:>10.2f}"
+                f" / {r['latency_p99_ms']:>9.2f} / {r['latency_max_ms']:>9.2f}"
+            )
+
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.depth = 0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+
+    def record(self, depth, waited, took):
+        with self.lock:
+            self.items += 1
+            self.busy += took
+            self.latency += waited + took
+            self.max_latency = max(self.max_latency, waited + took)
+            self.depth += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def line(self, elapsed):
+        n = self.items or 1
+        utilization = self.busy / (self.workers * elapsed) if elapsed else 0
+        return (
+            f"{self.name:<10}| {self.workers:>3} workers | {self.items:>6} items"
+            f" | {utilization:>4.0%} busy | queue {self.depth / n:>5.1f}"
+            f" (max {self.max_depth:>3}) | latency {self.latency / n * 1e3:>8.1f} ms"
+            f" (max {self.max_latency * 1e3:.1f})"
+        )
+
+
+class Pipeline:
+    """Stages of worker threads chained through bounded queues.
+
+    stages is a list of (name, func, workers): func maps one item to the
+    item for the next stage. A full queue blocks the stage feeding it
+    (backpressure). The first exception stops every stage and is re-raised
+    from run(); a sentinel per worker shuts each stage down in order.
+    """
+
+    _DONE = object()
+
+    def __init__(self, stages, maxsize=16):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+        self.stats = [StageStats(name, workers) for name, _, workers in stages]
+        self.stop = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def _put(self, q, item):
+        # Blocks while q is full, unless the pipeline is stopping
+        while not self.stop.is_set():
+            try:
+                q.put((time.perf_counter(), item), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None, self._DONE
+
+    def _feed(self, items):
+        try:
+            for item in items:
+                if not self._put(self.queues[0], item):
+                    return
+        except Exception as e:
+            self._fail("input", e)
+        for _ in range(self.stages[0][2]):
+            self._put(self.queues[0], self._DONE)
+
+    def _work(self, i, func, remaining):
+        inbox, outbox, stats = self.queues[i], self.queues[i + 1], self.stats[i]
+        while True:
+            depth = inbox.qsize()
+            queued, item = self._get(inbox)
+            if item is self._DONE:
+                break
+            start = time.perf_counter()
+            try:
+                result = func(item)
+            except Exception as e:
+                self._fail(stats.name, e)
+                return
+            finish = time.perf_counter()
+            stats.record(depth, start - queued, finish - start)
+            if not self._put(outbox, result):
+                return
+        # The stage's last worker passes the shutdown on
+        with self.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            next_workers = self.stages[i + 1][2] if i + 1 < len(self.stages) else 1
+            for _ in range(next_workers):
+                self._put(outbox, self._DONE)
+
+    def _fail(self, name, error):
+        with self.lock:
+            if self.error is None:
+                logging.error(f"Pipeline stage {name} failed: {error!r}")
+                self.error = error
+        self.stop.set()
+
+    def run(self, items):
+        """Yields the last stage's results in order of completion."""
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._feed, args=[items], daemon=True)]
+        for i, (name, func, workers) in enumerate(self.stages):
+            remaining = [workers]
+            threads += [
+                threading.Thread(
+                    target=self._work,
+                    args=[i, func, remaining],
+                    name=f"{name}-{n}",
+                    daemon=True,
+                )
+                for n in range(workers)
+            ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                _, item = self._get(self.queues[-1])
+                if item is self._DONE:
+                    break
+                yield item
+        finally:
+            # Also reached if the caller stops iterating early
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        for stats in self.stats:
+            print(stats.line(self.elapsed))
+
+
+def fetch(seconds, i):
+    time.sleep(seconds)
+    return i
+
+
+def parse(seconds, i):
+    time.sleep(seconds)
+    return {"id": i}
+
+
+def write(seconds, record):
+    time.sleep(seconds)
+    return record["id"]
+
+
+@timer
+def with_pipeline(seconds, n_threads, n_items=None):
+    # fetch is IO-bound and parallel; the single parse thread is the
+    # bottleneck, which the report shows as ~100% busy with a full queue
+    pipeline = Pipeline(
+        [
+            ("fetch", functools.partial(fetch, seconds), n_threads),
+            ("parse", functools.partial(parse, seconds / n_threads), 1),
+            ("write", functools.partial(write, seconds / (4 * n_threads)), 1),
+        ],
+        maxsize=n_threads,
+    )
+    results = list(pipeline.run(range(n_items or 4 * n_threads)))
+    print(f"{len(results)} items through the pipeline")
+    pipeline.report()
+
+
 def main():
     args = cli()
+    if args.trial:
+        print(json.dumps(run_trial(args.trial, args.seconds, args.threads)))
+        return
+    if args.compare:
+        compare(args.seconds, args.compare)
+        return
+    if args.pipeline:
+        with_pipeline(args.seconds, args.threads)
+        return
     no_threading(args.seconds, args.threads)
     with_threading(args.seconds, args.threads)
     with_thread_pool(args.seconds, args.threads)
+    if args.asyncio:
+        with_asyncio(args.seconds, args.threads)
+        if args.limit:
+            with_asyncio(args.seconds, args.threads, args.limit)
 
 
 if __name__ == "__main__":
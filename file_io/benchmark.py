@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""Sweeps copy_file.py's strategies and chunk sizes over synthetic files."""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+from copy_file import (
+    CHUNK_SIZES,
+    COPIERS,
+    MB,
+    copy_text_chunks,
+    copy_text_file,
+    save_best_chunk,
+    time_copy,
+)
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d", "--dir", help="directory (device) to benchmark", default="."
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        help="synthetic file sizes (MB)",
+        nargs="+",
+        default=[1, 16, 128],
+        type=int,
+    )
+    parser.add_argument(
+        "-c",
+        "--chunks",
+        help="chunk sizes to sweep (bytes)",
+        nargs="+",
+        default=CHUNK_SIZES,
+        type=int,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="runs per measurement (best kept)",
+        default=3,
+        type=int,
+    )
+    parser.add_argument("-o", "--output", help="JSON report file (default: stdout)")
+    parser.add_argument(
+        "--no-save",
+        help="don't cache the best chunk size for --chunk auto",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+def make_text(path, size):
+    # Random printable lines of varying length
+    rng = random.Random(size)
+    alphabet = string.ascii_letters + string.digits + " "
+    with open(path, "w") as f:
+        written = 0
+        while written < size:
+            line = "".join(rng.choices(alphabet, k=rng.randint(10, 120))) + "\n"
+            f.write(line)
+            written += len(line)
+
+
+def make_binary(path, size):
+    with open(path, "wb") as f:
+        for _ in range(0, size, MB):
+            f.write(os.urandom(min(MB, size - f.tell())))
+
+
+def best_of(repeat, func, *args):
+    times = [func(*args) for _ in range(repeat)]
+    return min(times), statistics.median(times)
+
+
+def time_text(func, src, dst, *args):
+    # copy_text_* without print_msg's output
+    start = time.perf_counter()
+    func.__wrapped__(src, dst, *args)
+    return time.perf_counter() - start
+
+
+def measure(kind, src, dst, size, chunks, repeat):
+    results = []
+
+    def record(strategy, chunk, best, median):
+        results.append(
+            {
+                "file": kind,
+                "size": size,
+                "strategy": strategy,
+                "chunk": chunk,
+                "best_s": best,
+                "median_s": median,
+                "mb_per_s": size / MB / best,
+            }
+        )
+        logging.info(
+            f"{kind:>6} {size / MB:>6.0f} MB | {strategy:<16} {chunk or '-':>9}"
+            f" | {size / MB / best:>9.1f} MB/s"
+        )
+
+    if kind == "text":
+        times = best_of(repeat, time_text, copy_text_file, src, dst)
+        record("copy_text_file", None, *times)
+        for chunk in chunks:
+            times = best_of(repeat, time_text, copy_text_chunks, src, dst, chunk)
+            record("copy_text_chunks", chunk, *times)
+    for strategy, copier in COPIERS.items():
+        # Kernel strategies don't use a buffer: one run, no chunk sweep
+        sweep = chunks if strategy in ("readinto", "mmap") else [None]
+        for chunk in sweep:
+            try:
+                times = best_of(repeat, time_copy, copier, src, dst, chunk or MB)
+            except OSError as e:
+                logging.warning(f"{strategy} unsupported here: {e}")
+                break
+            record(strategy, chunk, *times)
+    return results
+
+
+def main():
+    args = cli()
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        dst = os.path.join(tmp, "copy")
+        for size_mb in args.sizes:
+            size = size_mb * MB
+            for kind, make in (("text", make_text), ("binary", make_binary)):
+                src = os.path.join(tmp, f"{kind}-{size_mb}")
+                make(src, size)
+                # The text file's lines may not land exactly on size
+                actual = os.path.getsize(src)
+                results += measure(kind, src, dst, actual, args.chunks, args.repeat)
+                os.remove(src)
+
+    # Best chunk: readinto on the largest binary file
+    largest = max(args.sizes) * MB
+    readinto = [
+        r
+        for r in results
+        if r["strategy"] == "readinto"
+        and r["file"] == "binary"
+        and r["size"] >= largest
+    ]
+    best_chunk = None
+    if readinto:
+        best_chunk = max(readinto, key=lambda r: r["mb_per_s"])["chunk"]
+    if best_chunk and not args.no_save:
+        save_best_chunk(args.dir, best_chunk)
+        logging.info(f"Saved chunk size {best_chunk:,} for --chunk auto")
+
+    report = {
+        "dir": os.path.abspath(args.dir),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "best_chunk": best_chunk,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
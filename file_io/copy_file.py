@@ -1,14 +1,95 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import errno
+import functools
+import hashlib
+import heapq
+import json
 import logging
+import mmap
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+
+MB = 1 << 20
+# Bytes per copy_file_range()/sendfile() call (never pass through Python)
+KERNEL_CHUNK = 64 * MB
+STRATEGIES = ("copy_file_range", "sendfile", "readinto")
+# "Not supported here" errors: try the next strategy instead of failing
+FALLBACK_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP}
+CHECKSUM = "sha256"
+# Per-block digests for --delta (only used to spot changed blocks)
+BLOCK_DIGEST_SIZE = 16
+# Candidates for --chunk auto, and where the winner is kept per device
+CHUNK_SIZES = [4 << 10, 16 << 10, 64 << 10, 256 << 10, MB, 4 * MB, 16 * MB]
+CHUNK_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "py_notes",
+    "copy_chunk.json",
+)
+
+
+def chunk_arg(value):
+    return value if value == "auto" else int(value)
 
 
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument("input", help="file to be copied")
     parser.add_argument("output", help="file to be written")
-    parser.add_argument("chunk", help="chunk size", type=int)
+    parser.add_argument(
+        "chunk",
+        help="chunk size, or 'auto' for the best measured on this device",
+        type=chunk_arg,
+    )
+    parser.add_argument(
+        "-s",
+        "--strategy",
+        help="only run copy_bytes(), with this strategy",
+        choices=["auto", *COPIERS],
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        help="only run copy_parallel() (byte ranges on a thread pool)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="threads for --parallel/--delta",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "-r",
+        "--range-size",
+        help="bytes per range for --parallel",
+        default=64 * MB,
+        type=int,
+    )
+    parser.add_argument(
+        "-d",
+        "--delta",
+        help="only run copy_delta() (rewrite blocks that differ)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--block-size", help="bytes per block for --delta", default=MB, type=int
+    )
+    parser.add_argument(
+        "-t",
+        "--tree",
+        help="input and output are directories: run copy_tree()",
+        action="store_true",
+    )
     parser.add_argument(
         "-q", "--quiet", help="only show warnings and errors", action="store_true"
     )
@@ -21,10 +102,21 @@ def cli():
 
 
 def print_msg(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         logging.info(f"{func.__name__}{args}...")
-        func(*args, **kwargs)
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
         logging.info(f"'{args[0]}' copied to '{args[1]}'")
+        size = os.path.getsize(args[1]) / MB
+        # copy_bytes() returns the strategy it ended up using
+        name = f"{func.__name__}[{result}]" if result else func.__name__
+        print(
+            f"{name}: {size:,.1f} MB in {elapsed:.3f} seconds"
+            f" ({size / elapsed:,.1f} MB/s)"
+        )
+        return result
 
     return wrapper
 
@@ -45,17 +137,559 @@ def copy_text_chunks(input_path, output_path, chunk_size):
             rf_chunk = rf.read(chunk_size)
 
 
+# Each strategy copies rf[offset:size] to the same offset in wf and returns
+# where it stopped. They raise OSError if the OS can't do it for these files.
+def via_copy_file_range(rf, wf, offset, size, chunk_size):
+    # In-kernel copy (may even share extents on btrfs/xfs/NFS)
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range() not available")
+    while offset < size:
+        count = min(KERNEL_CHUNK, size - offset)
+        n = os.copy_file_range(rf.fileno(), wf.fileno(), count, offset, offset)
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def via_sendfile(rf, wf, offset, size, chunk_size):
+    # In-kernel copy through the page cache; writes at wf's file position
+    if not hasattr(os, "sendfile"):
+        raise OSError(errno.ENOSYS, "sendfile() not available")
+    os.lseek(wf.fileno(), offset, os.SEEK_SET)
+    while offset < size:
+        count = min(KERNEL_CHUNK, size - offset)
+        n = os.sendfile(wf.fileno(), rf.fileno(), offset, count)
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def via_readinto(rf, wf, offset, size, chunk_size):
+    # One buffer, reused for every chunk (read until EOF, size may be unknown)
+    buf = memoryview(bytearray(chunk_size))
+    rf.seek(offset)
+    wf.seek(offset)
+    n = rf.readinto(buf)
+    while n:
+        written = 0
+        while written < n:
+            written += wf.write(buf[written:n])
+        offset += n
+        n = rf.readinto(buf)
+    return offset
+
+
+def via_mmap(rf, wf, offset, size, chunk_size):
+    # Write straight out of the mapped input, chunk_size bytes at a time
+    if size <= offset:
+        return offset
+    wf.seek(offset)
+    with mmap.mmap(rf.fileno(), size, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as buf:
+            while offset < size:
+                with buf[offset : offset + chunk_size] as chunk:
+                    offset += wf.write(chunk)
+    return offset
+
+
+COPIERS = {
+    "copy_file_range": via_copy_file_range,
+    "sendfile": via_sendfile,
+    "readinto": via_readinto,
+    "mmap": via_mmap,
+}
+
+
+def copy_fd_range(rf, wf, strategy="auto", chunk_size=MB, offset=0, size=None):
+    """Copies rf[offset:size] into wf with the first strategy that works.
+
+    Returns (strategy that finished the copy, end offset).
+    """
+    info = os.fstat(rf.fileno())
+    if size is None:
+        size = info.st_size
+    order = STRATEGIES if strategy == "auto" else (strategy,)
+    # /proc files and pipes report a size of 0: only a read loop sees their data
+    if strategy == "auto" and (not stat.S_ISREG(info.st_mode) or size == 0):
+        order = ("readinto",)
+
+    for name in order:
+        try:
+            return name, COPIERS[name](rf, wf, offset, size, chunk_size)
+        except OSError as e:
+            if strategy != "auto" or e.errno not in FALLBACK_ERRNOS:
+                raise
+            logging.info(f"{name} unsupported here ({e.strerror}), falling back")
+    raise OSError(errno.ENOSYS, "no copy strategy available")
+
+
 @print_msg
-def copy_bytes(input_path, output_path):
+def copy_bytes(input_path, output_path, strategy="auto", chunk_size=MB):
     # Use 'rb' and 'wb' to read/write bytes
     # Works for all file formats (txt, jpg, etc)
-    with open(input_path, "rb") as rf, open(output_path, "wb") as wf:
-        for line in rf:
-            wf.write(line)
+    # Unbuffered: the strategies do their own (or no) buffering
+    with open(input_path, "rb", buffering=0) as rf, open(
+        output_path, "wb", buffering=0
+    ) as wf:
+        used, end = copy_fd_range(rf, wf, strategy, chunk_size)
+        wf.truncate(end)
+    return used
+
+
+def _copy_or_hash(fd, start, end, chunk_size, out_fd=None):
+    # Checksum of fd[start:end], pwrite()n to out_fd on the way if given.
+    # preadv/pwrite/hashing release the GIL, so ranges run truly in parallel
+    digest = hashlib.new(CHECKSUM)
+    buf = memoryview(bytearray(max(1, min(chunk_size, end - start))))
+    offset = start
+    while offset < end:
+        view = buf[: min(len(buf), end - offset)]
+        n = os.preadv(fd, [view], offset)
+        if n == 0:
+            raise OSError(errno.EIO, f"unexpected EOF at byte {offset}")
+        view = view[:n]
+        digest.update(view)
+        written = 0
+        while out_fd is not None and written < n:
+            written += os.pwrite(out_fd, view[written:], offset + written)
+        offset += n
+    if out_fd is not None:
+        # A range is only recorded as done once it's on disk
+        os.fdatasync(out_fd)
+    return digest.hexdigest()
+
+
+class RangeJournal:
+    """Sidecar file listing the ranges of a parallel copy that are done.
+
+    The first line identifies the input (size, mtime, range size); a copy of
+    a different input/range size starts over instead of resuming.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.lock = threading.Lock()
+
+    def load(self):
+        # {start: (end, digest)} from a previous run of the same copy
+        try:
+            with open(self.path, "r") as f:
+                if f.readline().strip() != self.key:
+                    return {}
+                done = {}
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 3:
+                        done[int(fields[0])] = (int(fields[1]), fields[2])
+                return done
+        except FileNotFoundError:
+            return {}
+
+    def start(self, done):
+        with open(self.path, "w") as f:
+            f.write(f"{self.key}\n")
+            for start, (end, digest) in sorted(done.items()):
+                f.write(f"{start} {end} {digest}\n")
+
+    def record(self, start, end, digest):
+        with self.lock, open(self.path, "a") as f:
+            f.write(f"{start} {end} {digest}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        os.remove(self.path)
+
+
+def _preallocate(fd, size):
+    # Reserve the blocks up front (fewer extents, ENOSPC before copying)
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+@print_msg
+def copy_parallel(
+    input_path, output_path, workers=8, range_size=64 * MB, chunk_size=MB
+):
+    # Byte ranges copied concurrently with pread/pwrite into a preallocated
+    # output; a '.ranges' journal lets an interrupted copy resume
+    rfd = os.open(input_path, os.O_RDONLY)
+    wfd = os.open(output_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        info = os.fstat(rfd)
+        size = info.st_size
+        key = f"{size} {info.st_mtime_ns} {range_size}"
+        journal = RangeJournal(output_path + ".ranges", key)
+        done = journal.load()
+        if done:
+            logging.info(f"Resuming: {len(done)} ranges already copied")
+        else:
+            os.ftruncate(wfd, 0)
+        journal.start(done)
+        _preallocate(wfd, size)
+
+        todo = [
+            (start, min(start + range_size, size))
+            for start in range(0, size, range_size)
+            if start not in done
+        ]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {}
+            for start, end in todo:
+                args = (rfd, start, end, chunk_size, wfd)
+                future = executor.submit(_copy_or_hash, *args)
+                futures[future] = (start, end)
+            for future in concurrent.futures.as_completed(futures):
+                start, end = futures[future]
+                done[start] = (end, future.result())
+                journal.record(start, end, done[start][1])
+        except BaseException:
+            # Ctrl-C or a failed range: finish running ranges, drop the rest
+            executor.shutdown(cancel_futures=True)
+            logging.error(f"Copy interrupted, re-run to resume from {journal.path}")
+            raise
+        executor.shutdown()
+
+        # Verify what is on disk against the input's checksums, in parallel too
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            checks = {
+                start: executor.submit(_copy_or_hash, wfd, start, end, chunk_size)
+                for start, (end, digest) in done.items()
+            }
+        bad = [start for start, f in checks.items() if f.result() != done[start][1]]
+        if bad:
+            journal.start({s: r for s, r in done.items() if s not in bad})
+            raise OSError(
+                errno.EIO, f"{len(bad)} ranges failed verification, re-run to recopy"
+            )
+        os.ftruncate(wfd, size)
+        journal.remove()
+        logging.info(f"Verified {len(done)} ranges ({CHECKSUM})")
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+def _block_digest(block):
+    return hashlib.blake2b(block, digest_size=BLOCK_DIGEST_SIZE).digest()
+
+
+def _block_digests(buf, block_size, workers):
+    # buf is a memoryview (of an mmap): slicing it copies nothing, and
+    # blake2b releases the GIL, so blocks hash in parallel on the pool
+    blocks = (buf[i : i + block_size] for i in range(0, len(buf), block_size))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_block_digest, blocks))
+
+
+class BlockSidecar:
+    """Block digests of a file, valid while its size and mtime don't change."""
+
+    def __init__(self, path, block_size):
+        self.path = path
+        self.block_size = block_size
+
+    def _key(self, info):
+        return f"{info.st_size} {info.st_mtime_ns} {self.block_size}\n".encode()
+
+    def load(self, info):
+        try:
+            with open(self.path, "rb") as f:
+                if f.readline() != self._key(info):
+                    return None
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return [
+            data[i : i + BLOCK_DIGEST_SIZE]
+            for i in range(0, len(data), BLOCK_DIGEST_SIZE)
+        ]
+
+    def save(self, info, digests):
+        with open(self.path, "wb") as f:
+            f.write(self._key(info))
+            f.write(b"".join(digests))
+
+
+@print_msg
+def copy_delta(input_path, output_path, block_size=MB, workers=8):
+    # Only rewrites the blocks of output that differ from input (rsync-like)
+    sidecar = BlockSidecar(output_path + ".blocks", block_size)
+    # O_APPEND ('a+b') would send every pwrite() to the end of the file
+    fd = os.open(output_path, os.O_RDWR | os.O_CREAT, 0o644)
+    with open(input_path, "rb") as rf, open(fd, "r+b") as wf:
+        size = os.fstat(rf.fileno()).st_size
+        dst_info = os.fstat(wf.fileno())
+        dst_digests = sidecar.load(dst_info)
+        if dst_digests is None and dst_info.st_size:
+            logging.info(f"Hashing '{output_path}' (no valid {sidecar.path})")
+            with mmap.mmap(wf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as buf:
+                    dst_digests = _block_digests(buf, block_size, workers)
+        dst_digests = dst_digests or []
+
+        # Shrink or grow first; blocks past the old end never match
+        os.ftruncate(wf.fileno(), size)
+        written = blocks = 0
+        src_digests = []
+        if size:
+            with mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as buf:
+                    src_digests = _block_digests(buf, block_size, workers)
+                    for i, digest in enumerate(src_digests):
+                        if i < len(dst_digests) and dst_digests[i] == digest:
+                            continue
+                        offset = i * block_size
+                        with buf[offset : offset + block_size] as block:
+                            done = 0
+                            while done < len(block):
+                                done += os.pwrite(
+                                    wf.fileno(), block[done:], offset + done
+                                )
+                            written += len(block)
+                        blocks += 1
+        wf.flush()
+        os.fsync(wf.fileno())
+        sidecar.save(os.fstat(wf.fileno()), src_digests)
+    print(
+        f"copy_delta: wrote {written:,} of {size:,} bytes"
+        f" ({blocks} of {len(src_digests)} blocks)"
+    )
+
+
+class TreeStats:
+    """Counters shared by copy_tree() workers, plus the slowest files."""
+
+    def __init__(self, keep_slowest=10):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.queued = 0
+        self.keep_slowest = keep_slowest
+        self.slowest = []  # min-heap of (seconds, path)
+
+    def file_done(self, path, size, seconds):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, (seconds, path))
+            else:
+                heapq.heappushpop(self.slowest, (seconds, path))
+
+    def line(self):
+        elapsed = time.perf_counter() - self.start
+        return (
+            f"{self.files:,} files ({self.files / elapsed:,.0f} files/s)"
+            f" | {self.bytes / MB:,.1f} MB ({self.bytes / MB / elapsed:,.1f} MB/s)"
+            f" | queue: {self.queued} | errors: {self.errors}"
+        )
+
+
+def _report(stats, stop, interval):
+    while not stop.wait(interval):
+        print(stats.line(), file=sys.stderr)
+
+
+def _copy_batch(batch, stats, strategy, chunk_size):
+    # One pool task: several small files, or a single large one
+    for src, dst, size in batch:
+        start = time.perf_counter()
+        try:
+            if os.path.islink(src):
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                os.symlink(os.readlink(src), dst)
+            else:
+                with open(src, "rb", buffering=0) as rf, open(
+                    dst, "wb", buffering=0
+                ) as wf:
+                    copy_fd_range(rf, wf, strategy, chunk_size)
+            shutil.copystat(src, dst, follow_symlinks=False)
+        except OSError as e:
+            logging.error(f"{src}: {e}")
+            with stats.lock:
+                stats.errors += 1
+            continue
+        stats.file_done(src, size, time.perf_counter() - start)
+
+
+def _walk(root):
+    # os.scandir() returns types (and sizes via stat cache) without extra calls
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError as e:
+            logging.error(f"{path}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    yield entry, True
+                elif entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                    yield entry, False
+                else:
+                    logging.warning(f"Skipping special file {entry.path}")
+
+
+def copy_tree(
+    input_dir,
+    output_dir,
+    workers=8,
+    strategy="auto",
+    chunk_size=MB,
+    batch_bytes=MB,
+    batch_files=64,
+    interval=1.0,
+):
+    # Mirrors input_dir into output_dir (metadata included) on a thread pool.
+    # Files under batch_bytes travel in batches to amortize per-task overhead
+    stats = TreeStats()
+    stop = threading.Event()
+    reporter = threading.Thread(target=_report, args=[stats, stop, interval])
+    reporter.start()
+    # Bounds the tasks waiting in the pool (the walk pauses when it's full)
+    slots = threading.BoundedSemaphore(workers * 4)
+    dirs = [(input_dir, output_dir)]
+    os.makedirs(output_dir, exist_ok=True)
+
+    def task_done(future):
+        with stats.lock:
+            stats.queued -= 1
+        slots.release()
+
+    def submit(batch):
+        slots.acquire()
+        with stats.lock:
+            stats.queued += 1
+        future = executor.submit(_copy_batch, batch, stats, strategy, chunk_size)
+        future.add_done_callback(task_done)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            batch, batch_size = [], 0
+            for entry, is_dir in _walk(input_dir):
+                dst = os.path.join(output_dir, os.path.relpath(entry.path, input_dir))
+                if is_dir:
+                    os.makedirs(dst, exist_ok=True)
+                    dirs.append((entry.path, dst))
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+                if size >= batch_bytes:
+                    submit([(entry.path, dst, size)])
+                    continue
+                batch.append((entry.path, dst, size))
+                batch_size += size
+                if len(batch) >= batch_files or batch_size >= batch_bytes:
+                    submit(batch)
+                    batch, batch_size = [], 0
+            if batch:
+                submit(batch)
+    finally:
+        stop.set()
+        reporter.join()
+
+    # Directory times last (creating files inside them changes their mtime)
+    for src, dst in reversed(dirs):
+        shutil.copystat(src, dst)
+
+    elapsed = time.perf_counter() - stats.start
+    print(f"copy_tree: {stats.line()} in {elapsed:.3f} seconds")
+    print("slowest files:")
+    for seconds, path in sorted(stats.slowest, reverse=True):
+        print(f"{seconds * 1000:>10.1f} ms  {path}")
+
+
+def _device_key(path):
+    dev = os.stat(path).st_dev
+    return f"{os.major(dev)}:{os.minor(dev)}"
+
+
+def load_chunk_cache():
+    try:
+        with open(CHUNK_CACHE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_best_chunk(directory, chunk_size):
+    cache = load_chunk_cache()
+    cache[_device_key(directory)] = chunk_size
+    os.makedirs(os.path.dirname(CHUNK_CACHE), exist_ok=True)
+    with open(CHUNK_CACHE, "w") as f:
+        json.dump(cache, f, indent=2)
+
+
+def time_copy(copier, input_path, output_path, chunk_size):
+    # Seconds for one copy; input evicted from the page cache first if we can
+    with open(input_path, "rb", buffering=0) as rf, open(
+        output_path, "wb", buffering=0
+    ) as wf:
+        if hasattr(os, "posix_fadvise"):
+            # Dirty pages can't be dropped: a freshly written input has to
+            # reach the disk first, or it is mostly read from memory
+            os.fsync(rf.fileno())
+            os.posix_fadvise(rf.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        start = time.perf_counter()
+        copier(rf, wf, 0, os.fstat(rf.fileno()).st_size, chunk_size)
+        wf.flush()
+        return time.perf_counter() - start
+
+
+def tune_chunk(directory, sizes=CHUNK_SIZES, file_size=32 * MB):
+    # Quick readinto sweep on a scratch file in directory
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        src, dst = os.path.join(tmp, "src"), os.path.join(tmp, "dst")
+        with open(src, "wb") as f:
+            f.write(os.urandom(file_size))
+        times = {size: time_copy(via_readinto, src, dst, size) for size in sizes}
+    return min(times, key=times.get)
+
+
+def best_chunk(path):
+    # Chunk size for the device holding path: cached, else measured now
+    directory = os.path.dirname(os.path.abspath(path))
+    chunk_size = load_chunk_cache().get(_device_key(directory))
+    if chunk_size is None:
+        logging.info(f"Measuring the best chunk size for {directory}...")
+        chunk_size = tune_chunk(directory)
+        save_best_chunk(directory, chunk_size)
+    logging.info(f"Using chunk size {chunk_size:,} (see {CHUNK_CACHE})")
+    return chunk_size
 
 
 def main():
     args = cli()
+    if args.chunk == "auto":
+        args.chunk = best_chunk(args.output)
+    if args.tree:
+        strategy = args.strategy or "auto"
+        copy_tree(args.input, args.output, args.workers, strategy, args.chunk)
+        return
+    if args.delta:
+        copy_delta(args.input, args.output, args.block_size, args.workers)
+        return
+    if args.parallel:
+        copy_parallel(
+            args.input, args.output, args.workers, args.range_size, args.chunk
+        )
+        return
+    if args.strategy:
+        copy_bytes(args.input, args.output, args.strategy, args.chunk)
+        return
+
     try:
         copy_text_file(args.input, args.output)
         copy_text_chunks(args.input, args.output, args.chunk)
@@ -63,7 +697,7 @@ def main():
         logging.error(f"{type(e).__name__}: {e}")
         logging.error(f"{args.input} file type unsupported")
         logging.error("skipping copy_text_file() and copy_text_chunks()")
-    copy_bytes(args.input, args.output)
+    copy_bytes(args.input, args.output, chunk_size=args.chunk)
 
 
 if __name__ == "__main__":
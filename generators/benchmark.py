@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""Throughput and peak memory of the square.py generators."""
+
+import argparse
+import collections
+import logging
+import time
+import tracemalloc
+
+from square import (
+    CHUNK_SIZE,
+    numpy,
+    square_chunks,
+    square_comprehension,
+    square_nums,
+    square_vectorized,
+)
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--count", help="numbers to square", default=10_000_000, type=int
+    )
+    parser.add_argument(
+        "--chunk-size",
+        help="numbers per vectorized batch",
+        default=CHUNK_SIZE,
+        type=int,
+    )
+    parser.add_argument(
+        "-r", "--repeat", help="timed runs per method (best kept)", default=3, type=int
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+def source(n):
+    # Lazy input: floats are made as they're consumed, never all at once
+    return map(float, range(n))
+
+
+def consume(iterable):
+    # Drains at C speed, keeping nothing
+    collections.deque(iterable, maxlen=0)
+
+
+def methods(chunk_size):
+    yield "generator", lambda nums: consume(square_nums(nums))
+    yield "genexpr", lambda nums: consume(square_comprehension(nums))
+    if numpy is None:
+        logging.warning("numpy isn't installed: skipping the vectorized methods")
+        return
+    # Whole chunks, as a vectorized consumer would take them
+    yield "chunks", lambda nums: consume(square_chunks(nums, chunk_size))
+    # Flattened back to one float at a time
+    yield "flat", lambda nums: consume(square_vectorized(nums, chunk_size))
+
+
+def check(chunk_size):
+    # Every method must produce the same squares
+    n = 2 * chunk_size + 3
+    expected = list(square_nums(source(n)))
+    got = list(square_vectorized(source(n), chunk_size))
+    if got != expected:
+        raise RuntimeError("vectorized: wrong squares")
+
+
+def measure(run, n, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(source(n))
+        best = min(best, time.perf_counter() - start)
+    # A separate run for memory: tracing slows everything down
+    tracemalloc.start()
+    try:
+        run(source(n))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    args = cli()
+    check(args.chunk_size)
+    logging.info(
+        f"Squaring {args.count:,} numbers, {args.chunk_size:,} per chunk,"
+        f" best of {args.repeat}"
+    )
+    print(f"{'method':<12}| {'best':>8} | {'elements/s':>13} | {'peak memory':>11}")
+    for name, run in methods(args.chunk_size):
+        best, peak = measure(run, args.count, args.repeat)
+        print(
+            f"{name:<12}| {best:>7.3f}s | {args.count / best:>13,.0f}"
+            f" | {peak / 2**20:>8.2f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+"""Lazy pipelines of generator stages, with optional parallel maps."""
+
+import argparse
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import math
+import pickle
+import time
+
+from square import square_nums
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--count", help="numbers to push through", default=1_000_000, type=int
+    )
+    parser.add_argument(
+        "-w", "--workers", help="workers for the parallel stage", default=4, type=int
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        help="run the parallel stage on processes, not threads (its function"
+        " must pickle)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+class StageStats:
+    def __init__(self, name, upstream=None):
+        self.name = name
+        self.upstream = upstream
+        self.items = 0
+        # In next(): this stage plus everything upstream of it
+        self.elapsed = 0.0
+
+    @property
+    def own(self):
+        upstream = self.upstream.elapsed if self.upstream else 0.0
+        return max(self.elapsed - upstream, 0.0)
+
+    def line(self):
+        rate = self.items / self.own if self.own else 0
+        return (
+            f"{self.name:<40}| {self.items:>10,} items | {self.own:>8.3f} s"
+            f" | {rate:>12,.0f} items/s"
+        )
+
+
+def _timed(iterator, stats):
+    clock = time.perf_counter
+    while True:
+        start = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stats.elapsed += clock() - start
+            return
+        stats.elapsed += clock() - start
+        stats.items += 1
+        yield item
+
+
+def _apply(ops, iterator):
+    # Builtin map/filter run at C speed: only the functions themselves
+    # cost a Python call per item
+    for kind, func in ops:
+        iterator = map(func, iterator) if kind == "map" else filter(func, iterator)
+    return iterator
+
+
+def _run_chunk(ops, chunk):
+    return list(_apply(ops, chunk))
+
+
+def _parallel(iterator, ops, workers, processes, chunksize):
+    # Chunks go out in order and come back in order; at most two per
+    # worker are in flight, so memory stays bounded however long the input
+    if processes:
+        pool = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(workers)
+    chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+    pending = collections.deque()
+    try:
+        for chunk in itertools.islice(chunks, 2 * workers):
+            pending.append(pool.submit(_run_chunk, ops, chunk))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(pool.submit(_run_chunk, ops, chunk))
+            yield from results
+    finally:
+        # Closed early (take(), an error): don't run what's left
+        for future in pending:
+            future.cancel()
+        pool.shutdown()
+
+
+def _batch(iterator, size):
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _window(iterator, size, step):
+    window = collections.deque(maxlen=size)
+    for i, item in enumerate(iterator):
+        window.append(item)
+        if len(window) == size and (i + 1 - size) % step == 0:
+            yield tuple(window)
+
+
+def _round_robin(pipelines):
+    iterators = collections.deque(iter(p) for p in pipelines)
+    while iterators:
+        iterator = iterators.popleft()
+        for item in itertools.islice(iterator, 1):
+            yield item
+            iterators.append(iterator)
+
+
+class Stage:
+    def __init__(self, kind, name, func=None, ops=None, **options):
+        self.kind = kind
+        self.name = name
+        self.func = func
+        # map/filter: [(kind, func)], more than one once fused
+        self.ops = ops or []
+        self.options = options
+
+    def __call__(self, iterator):
+        if self.options.get("workers"):
+            return _parallel(iterator, self.ops, **self.options)
+        if self.ops:
+            return _apply(self.ops, iterator)
+        return self.func(iterator)
+
+
+class Pipeline:
+    """Stages chained lazily over an iterable, only run as it's iterated.
+
+    Every method returns a new Pipeline, leaving this one untouched. Runs
+    of serial map and filter stages are fused into a single stage unless
+    fuse=False: one timing layer over their chain of builtin map/filter
+    iterators, instead of a timing generator per stage. The functions are
+    still called one after another; composing them into one Python
+    function would add a call per item. A map or filter with workers runs
+    on a thread (or, with processes=True, process) pool, chunksize items
+    per task, in order. Processes need a function that pickles: defined at
+    module level, not a lambda or a closure.
+    """
+
+    def __init__(self, source, fuse=True, parents=(), name="source"):
+        self.source = source
+        self.name = name
+        self.fuse = fuse
+        self.parents = list(parents)
+        self.stages = []
+        self.stats = []
+
+    def _then(self, stage):
+        pipeline = Pipeline(self.source, self.fuse, self.parents, self.name)
+        pipeline.stages = self.stages + [stage]
+        return pipeline
+
+    def _op(self, kind, func, name, workers, processes, chunksize):
+        name = name or f"{kind} {getattr(func, '__name__', func)}"
+        options = {}
+        if workers and processes:
+            # Checked now: the pool would only fail once the stage runs
+            try:
+                pickle.dumps(func)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                raise TypeError(
+                    f"processes=True needs a module-level function, not {func!r}"
+                ) from e
+        if workers:
+            options = dict(workers=workers, processes=processes, chunksize=chunksize)
+        return self._then(Stage(kind, name, ops=[(kind, func)], **options))
+
+    def map(self, func, name=None, workers=0, processes=False, chunksize=256):
+        return self._op("map", func, name, workers, processes, chunksize)
+
+    def filter(self, func, name=None, workers=0, processes=False, chunksize=256):
+        return self._op("filter", func, name, workers, processes, chunksize)
+
+    def then(self, func, name=None):
+        # Any generator function of an iterable, e.g. square_nums
+        return self._then(Stage("then", name or func.__name__, func))
+
+    def batch(self, size):
+        return self._then(
+            Stage("batch", f"batch {size}", lambda it: _batch(it, size))
+        )
+
+    def window(self, size, step=1):
+        return self._then(
+            Stage("window", f"window {size}", lambda it: _window(it, size, step))
+        )
+
+    def take(self, n):
+        return self._then(
+            Stage("take", f"take {n}", lambda it: itertools.islice(it, n))
+        )
+
+    def tee(self, n=2):
+        # Branches buffer what one has read and another hasn't yet
+        branches = itertools.tee(iter(self), n)
+        return [
+            Pipeline(branch, self.fuse, [self], f"tee {i}")
+            for i, branch in enumerate(branches)
+        ]
+
+    @classmethod
+    def merge(cls, *pipelines, key=None, fuse=True):
+        # Round robin, or with key a sorted merge of sorted pipelines
+        if key:
+            source = heapq.merge(*pipelines, key=key)
+        else:
+            source = _round_robin(pipelines)
+        return cls(source, fuse, pipelines, "merge")
+
+    def _plan(self):
+        stages = []
+        for stage in self.stages:
+            last = stages[-1] if stages else None
+            if (
+                self.fuse
+                and stage.ops
+                and not stage.options
+                and last
+                and last.ops
+                and not last.options
+            ):
+                stages[-1] = Stage(
+                    "fused", f"{last.name} | {stage.name}", ops=last.ops + stage.ops
+                )
+            else:
+                stages.append(stage)
+        return stages
+
+    def __iter__(self):
+        stats = StageStats(self.name)
+        iterator = _timed(iter(self.source), stats)
+        self.stats = [stats]
+        for stage in self._plan():
+            stats = StageStats(stage.name, stats)
+            iterator = _timed(stage(iterator), stats)
+            self.stats.append(stats)
+        return iterator
+
+    def report(self, _seen=None):
+        # Upstream pipelines first, once each even if branches share them
+        seen = set() if _seen is None else _seen
+        if id(self) in seen:
+            return
+        seen.add(id(self))
+        for parent in self.parents:
+            parent.report(seen)
+        for stats in self.stats:
+            logging.info(stats.line())
+
+
+def is_prime(n):
+    if n < 2:
+        return False
+    return all(n % d for d in range(2, math.isqrt(n) + 1))
+
+
+def count_primes(batch):
+    return sum(map(is_prime, batch))
+
+
+def main():
+    args = cli()
+    for fuse in (False, True):
+        pipeline = (
+            Pipeline(range(args.count), fuse=fuse)
+            .then(square_nums)
+            .map(float)
+            .filter(lambda n: n % 3)
+            .map(int)
+            .map(math.isqrt)
+        )
+        start = time.perf_counter()
+        total = sum(pipeline)
+        elapsed = time.perf_counter() - start
+        logging.info(f"fuse={fuse}: sum {total} in {elapsed:.3f} s")
+        pipeline.report()
+
+    # Parallel and ordered: batch i's count always comes out i-th
+    counts = (
+        Pipeline(range(args.count))
+        .batch(10_000)
+        .map(
+            count_primes,
+            workers=args.workers,
+            processes=args.processes,
+            chunksize=1,
+        )
+    )
+    pairs, firsts = counts.tee()
+    merged = Pipeline.merge(pairs.window(2, 2).map(sum), firsts.take(3))
+    for item in merged:
+        logging.info(f"merged: {item}")
+    merged.report()
+
+
+if __name__ == "__main__":
+    main()
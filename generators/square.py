@@ -1,16 +1,62 @@
 #!/usr/bin/env python3
 
 import argparse
+import itertools
 import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHUNK_SIZE = 64 * 1024
+BLOCK_SIZE = 1024 * 1024
+METHODS = ("generator", "genexpr", "vectorized")
 
 
 def cli():
     parser = argparse.ArgumentParser()
-    parser.add_argument("nums", help="numbers to square", nargs="+", type=float)
+    parser.add_argument("nums", help="numbers to square", nargs="*", type=float)
+    parser.add_argument(
+        "-i",
+        "--input",
+        help="read whitespace-separated numbers from a file ('-': stdin)",
+    )
+    parser.add_argument(
+        "-b",
+        "--binary",
+        help="--input is raw little-endian float64, memory-mapped",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-m",
+        "--method",
+        help="squaring method (default: all three, in turn)",
+        choices=METHODS,
+    )
+    parser.add_argument(
+        "--chunk-size",
+        help="numbers squared per numpy batch",
+        default=CHUNK_SIZE,
+        type=int,
+    )
     parser.add_argument(
         "-q", "--quiet", help="only show warnings and errors", action="store_true"
     )
     args = parser.parse_args()
+    if bool(args.nums) == bool(args.input):
+        parser.error("give either numbers or --input")
+    if args.binary and args.input in (None, "-"):
+        parser.error("--binary needs an --input file to map")
+    if args.input == "-" and not args.method:
+        # Reading it once per method would find it empty the second time
+        parser.error("stdin can only be read once: pick a --method")
 
     format = "%(levelname)-5s | %(message)s"
     level = logging.WARNING if args.quiet else logging.INFO
@@ -18,6 +64,55 @@ def cli():
     return args
 
 
+def read_text(f, block_size=BLOCK_SIZE):
+    # Fixed-size reads, so even a single huge line takes constant memory
+    tail = ""
+    while block := f.read(block_size):
+        words = (tail + block).split()
+        # The last word may carry on in the next block
+        tail = words.pop() if words and not block[-1].isspace() else ""
+        yield from map(float, words)
+    if tail:
+        yield float(tail)
+
+
+@contextmanager
+def open_binary(path):
+    """memoryview of the float64s in a file, mapped rather than read."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size % 8:
+            raise ValueError(f"{path}: {size:,} bytes isn't a whole number of floats")
+        if not size:
+            # mmap can't map an empty file
+            yield memoryview(array("d"))
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                # Read front to back: more readahead, pages reclaimed behind
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            if sys.byteorder == "little":
+                with memoryview(mm) as buf, buf.cast("d") as nums:
+                    yield nums
+            else:
+                # A native cast would read them byte-swapped
+                yield (num for (num,) in struct.iter_unpack("<d", mm))
+
+
+@contextmanager
+def open_input(args):
+    if args.nums:
+        yield args.nums
+    elif args.binary:
+        with open_binary(args.input) as nums:
+            yield nums
+    elif args.input == "-":
+        yield read_text(sys.stdin)
+    else:
+        with open(args.input) as f:
+            yield read_text(f)
+
+
 def square_nums(nums):
     for num in nums:
         yield num * num
@@ -27,24 +122,76 @@ def square_comprehension(nums):
     return (num * num for num in nums)
 
 
-def print_gen_vals(generator):
+def square_chunks(nums, chunk_size=CHUNK_SIZE):
+    """Squares nums chunk_size at a time, yielding one numpy array per chunk.
+
+    Memory stays at a chunk or two whatever the length of nums. Needs
+    numpy: square_vectorized() does without it.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, not {chunk_size}")
+    if numpy is None:
+        raise ValueError("square_chunks() needs numpy installed")
+    if isinstance(nums, memoryview):
+        # Already a buffer (an mmap'd file): slice it, copying nothing in
+        for start in range(0, len(nums), chunk_size):
+            with nums[start : start + chunk_size] as batch:
+                yield numpy.square(numpy.frombuffer(batch, numpy.float64))
+        return
+    nums = iter(nums)
+    while True:
+        chunk = numpy.fromiter(itertools.islice(nums, chunk_size), numpy.float64)
+        if not len(chunk):
+            return
+        # In place: no second buffer
+        numpy.square(chunk, out=chunk)
+        yield chunk
+
+
+def square_vectorized(nums, chunk_size=CHUNK_SIZE):
+    # Same interface as square_nums: one float at a time. Without numpy
+    # there's no vector kernel to batch for, and square_nums is fastest
+    if numpy is None:
+        yield from square_nums(nums)
+        return
+    for chunk in square_chunks(nums, chunk_size):
+        yield from chunk.tolist()
+
+
+def print_gen_vals(generator, file=None, batch_size=CHUNK_SIZE):
+    file = file or sys.stdout
     # One at a time
-    print(next(generator))
-    # Or loop
-    for num in generator:
-        print(num)
+    first = next(generator, None)
+    if first is None:
+        return
+    print(first, file=file)
+    # Or loop, a batch of lines per write() rather than a print() per value
+    while batch := list(itertools.islice(generator, batch_size)):
+        file.write("\n".join(map(str, batch)))
+        file.write("\n")
+    file.flush()
 
 
 def main():
     args = cli()
-    # Generator object: all results not stored in memory
-    my_nums = square_nums(args.nums)
-    logging.info(f"my_nums: {my_nums}")
-    print_gen_vals(my_nums)
-
-    my_nums = square_comprehension(args.nums)
-    logging.info(f"my_nums: {my_nums}")
-    print_gen_vals(my_nums)
+    methods = {
+        "generator": square_nums,
+        "genexpr": square_comprehension,
+        "vectorized": lambda nums: square_vectorized(nums, args.chunk_size),
+    }
+    if numpy is None and args.method in (None, "vectorized"):
+        logging.warning("numpy isn't installed: vectorized is the generator")
+    for method in [args.method] if args.method else METHODS:
+        # Reopened per method: input is streamed, never held in memory
+        with open_input(args) as nums:
+            # Generator object: all results not stored in memory
+            my_nums = methods[method](nums)
+            logging.info(f"my_nums: {my_nums}")
+            try:
+                print_gen_vals(my_nums)
+            finally:
+                # Drops its slices of a mapped input before it's unmapped
+                my_nums.close()
 
 
 if __name__ == "__main__":
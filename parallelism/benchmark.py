@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+"""CPU-bound and mixed kernels under serial, threads, processes and asyncio."""
+
+import argparse
+import asyncio
+import concurrent.futures
+import csv
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import time
+import zlib
+
+from multiprocess import WorkerPool
+
+# Two-sided 95% Student t critical values by degrees of freedom (>30: ~normal)
+T95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+    8: 2.306, 9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042,
+}  # fmt: skip
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-k",
+        "--kernels",
+        help="kernels to run",
+        nargs="+",
+        choices=KERNELS,
+        default=list(KERNELS),
+    )
+    parser.add_argument(
+        "-e",
+        "--executors",
+        help="executors to run",
+        nargs="+",
+        choices=EXECUTORS,
+        default=list(EXECUTORS),
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="worker counts (default: 1, 2, 4, ... up to the CPU count)",
+        nargs="+",
+        type=int,
+    )
+    parser.add_argument(
+        "-t",
+        "--tasks",
+        help="tasks per run (same total work at every worker count)",
+        default=32,
+        type=int,
+    )
+    parser.add_argument(
+        "-s", "--scale", help="work per task multiplier", default=1.0, type=float
+    )
+    parser.add_argument(
+        "-r", "--repeat", help="timed runs per measurement", default=5, type=int
+    )
+    parser.add_argument(
+        "--warmup", help="untimed runs per measurement", default=1, type=int
+    )
+    parser.add_argument(
+        "-o", "--output", help="writes OUTPUT.json and OUTPUT.csv", default="scaling"
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+# Kernels: (cpu(n, seed), n, I/O seconds per task). Inputs are derived from
+# the seed only, so every run does exactly the same work
+def sha256_rounds(n, seed):
+    # hashlib releases the GIL for large buffers: threads can scale
+    data = random.Random(seed).randbytes(1 << 20)
+    digest = b""
+    for _ in range(n):
+        digest = hashlib.sha256(data + digest).digest()
+    return digest.hex()
+
+
+def numeric_loop(n, seed):
+    # Pure-Python arithmetic holds the GIL: threads can't scale
+    x = seed
+    total = 0
+    for i in range(n):
+        x = (x * 1103515245 + 12345) & 0x7FFFFFFF
+        total += x % (i + 1)
+    return total
+
+
+def compress(n, seed):
+    # zlib releases the GIL while compressing
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randint(2, 8)) for _ in range(512)]
+    data = b" ".join(rng.choices(words, k=n))
+    return len(zlib.compress(data, 6))
+
+
+KERNELS = {
+    "sha256": (sha256_rounds, 20, 0.0),
+    "numeric": (numeric_loop, 300_000, 0.0),
+    "zlib": (compress, 200_000, 0.0),
+    # CPU work plus a simulated 50 ms I/O wait per task
+    "mixed": (numeric_loop, 100_000, 0.05),
+}
+
+
+def run_task(kernel, n, seed, io):
+    result = KERNELS[kernel][0](n, seed)
+    if io:
+        time.sleep(io)
+    return result
+
+
+async def run_task_async(kernel, n, seed, io, semaphore):
+    # CPU work runs on the event loop itself; only the I/O wait overlaps
+    async with semaphore:
+        result = KERNELS[kernel][0](n, seed)
+        if io:
+            await asyncio.sleep(io)
+        return result
+
+
+def _noop(_):
+    return None
+
+
+class Executors:
+    """Starts (and warms) a pool per executor and worker count, once."""
+
+    def __init__(self):
+        self.pools = {}
+
+    def get(self, name, workers):
+        key = (name, workers)
+        if key not in self.pools:
+            if name == "threads":
+                pool = concurrent.futures.ThreadPoolExecutor(workers)
+            elif name == "pool":
+                pool = WorkerPool(workers)
+            elif name == "process_pool":
+                pool = concurrent.futures.ProcessPoolExecutor(workers)
+                list(pool.map(_noop, range(workers)))
+            self.pools[key] = pool
+        return self.pools[key]
+
+    def close(self):
+        for pool in self.pools.values():
+            if isinstance(pool, WorkerPool):
+                pool.close()
+            else:
+                pool.shutdown()
+
+
+def run_serial(executors, workers, tasks):
+    return [run_task(*task) for task in tasks]
+
+
+def run_threads(executors, workers, tasks):
+    return list(executors.get("threads", workers).map(run_task, *zip(*tasks)))
+
+
+def run_pool(executors, workers, tasks):
+    pool = executors.get("pool", workers)
+    return pool.pool.starmap(run_task, tasks, chunksize=1)
+
+
+def run_process_pool(executors, workers, tasks):
+    pool = executors.get("process_pool", workers)
+    return list(pool.map(run_task, *zip(*tasks)))
+
+
+def run_asyncio(executors, workers, tasks):
+    async def main():
+        semaphore = asyncio.Semaphore(workers)
+        return await asyncio.gather(
+            *(run_task_async(*task, semaphore) for task in tasks)
+        )
+
+    return asyncio.run(main())
+
+
+EXECUTORS = {
+    "serial": run_serial,
+    "threads": run_threads,
+    "pool": run_pool,
+    "process_pool": run_process_pool,
+    "asyncio": run_asyncio,
+}
+
+
+def ci95(times):
+    # Half-width of the 95% confidence interval of the mean
+    if len(times) < 2:
+        return 0.0
+    df = len(times) - 1
+    t = T95[max(k for k in T95 if k <= df)] if df <= 30 else 1.96
+    return t * statistics.stdev(times) / len(times) ** 0.5
+
+
+def make_tasks(kernel, n_tasks, scale):
+    # And every task's result, computed serially once (without the I/O wait)
+    cpu, n, io = KERNELS[kernel]
+    tasks = [(kernel, int(n * scale), seed, io) for seed in range(n_tasks)]
+    return tasks, [cpu(n, seed) for _, n, seed, _ in tasks]
+
+
+def measure(executors, executor, workers, tasks, expected, repeat, warmup):
+    times = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        results = EXECUTORS[executor](executors, workers, tasks)
+        elapsed = time.perf_counter() - start
+        if results != expected:
+            kernel = tasks[0][0]
+            raise RuntimeError(f"{kernel}/{executor}: wrong results")
+        if i >= warmup:
+            times.append(elapsed)
+    return times
+
+
+def main():
+    args = cli()
+    cpus = os.cpu_count()
+    workers = args.workers or sorted(
+        {min(2**i, cpus) for i in range(cpus.bit_length() + 1)}
+    )
+    executors = Executors()
+    results = []
+    try:
+        for kernel in args.kernels:
+            tasks, expected = make_tasks(kernel, args.tasks, args.scale)
+            serial = None
+            for executor in args.executors:
+                # Serial has nothing to scale
+                for n_workers in [1] if executor == "serial" else workers:
+                    times = measure(
+                        executors,
+                        executor,
+                        n_workers,
+                        tasks,
+                        expected,
+                        args.repeat,
+                        args.warmup,
+                    )
+                    mean = statistics.fmean(times)
+                    if executor == "serial":
+                        serial = mean
+                    # Relative to serial (None if serial wasn't run)
+                    speedup = serial / mean if serial else None
+                    results.append(
+                        {
+                            "kernel": kernel,
+                            "executor": executor,
+                            "workers": n_workers,
+                            "mean_s": mean,
+                            "ci95_s": ci95(times),
+                            "times_s": times,
+                            "speedup": speedup,
+                            "efficiency": speedup / n_workers if speedup else None,
+                        }
+                    )
+                    logging.info(
+                        f"{kernel:<8} | {executor:<12} | {n_workers:>3} workers"
+                        f" | {mean:>7.3f} s ± {ci95(times):.3f}"
+                        + (f" | {speedup:>5.2f}x" if speedup else "")
+                    )
+    finally:
+        executors.close()
+
+    report = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": cpus,
+        "tasks": args.tasks,
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "results": results,
+    }
+    with open(f"{args.output}.json", "w") as f:
+        json.dump(report, f, indent=2)
+    fields = ["kernel", "executor", "workers", "mean_s", "ci95_s", "speedup"]
+    fields.append("efficiency")
+    with open(f"{args.output}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Wrote {args.output}.json and {args.output}.csv")
+
+
+if __name__ == "__main__":
+    main()
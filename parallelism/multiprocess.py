@@ -4,10 +4,16 @@
 # threading for IO-bound tasks
 
 import argparse
+import array
 import concurrent.futures
 import logging
 import multiprocessing
+import os
+import statistics
 import time
+from multiprocessing import resource_tracker
+
+from shared_arrays import SharedArena, attach, split
 
 PROCESSES = 0
 
@@ -20,23 +26,45 @@ def cli():
     parser.add_argument(
         "-p", "--processes", help="how many processes", required=True, type=int
     )
+    parser.add_argument(
+        "-m",
+        "--method",
+        help="start method (default: the platform's)",
+        choices=multiprocessing.get_all_start_methods(),
+    )
+    parser.add_argument(
+        "--shm",
+        help="compare pickled vs shared-memory transport for an array of this"
+        " many MB instead",
+        type=int,
+    )
+    parser.add_argument(
+        "--measure",
+        help="measure spawn and dispatch overhead per start method instead",
+        action="store_true",
+    )
     parser.add_argument(
         "-q", "--quiet", help="only show warnings and errors", action="store_true"
     )
     args = parser.parse_args()
 
+    configure_logging(logging.WARNING if args.quiet else logging.INFO)
+    return args
+
+
+def configure_logging(level):
+    # Also the workers' initializer: spawned workers don't inherit it
     format = "%(levelname)-5s | %(message)s"
-    level = logging.WARNING if args.quiet else logging.INFO
     logging.basicConfig(format=format, level=level)
-    return args
 
 
 def timer(func):
     def wrapper(*args, **kwargs):
         start = time.perf_counter()
-        func(*args, **kwargs)
+        result = func(*args, **kwargs)
         finish = time.perf_counter()
         print(f"{func.__name__} finished in {round(finish - start, 1)} seconds")
+        return result
 
     return wrapper
 
@@ -62,7 +90,7 @@ def no_multi(seconds, processes):
 
 
 @timer
-def with_multi(seconds, processes):
+def with_multi(seconds, processes, pool=None):
     asc_seconds = []
     for i in range(processes):
         asc_seconds.append(seconds + i)
@@ -70,31 +98,214 @@ def with_multi(seconds, processes):
     # multiprocessing.Pool handles race condition of writing to shared memory
     # But processes (as opposed to threads) create separate memory spaces
     # --> Note: logger settings & global PROCESSES (pid) not ref'd from from main or shared
-    pool = multiprocessing.Pool(processes=processes)
-    results = pool.map(sleep_for, asc_seconds)
+    # Reuse a warm pool if given; a fresh one is closed and joined after
+    if pool is not None:
+        results = pool.map(sleep_for, asc_seconds)
+    else:
+        with multiprocessing.Pool(processes=processes) as fresh:
+            results = fresh.map(sleep_for, asc_seconds)
+            fresh.close()
+            fresh.join()
     print(f"pids: {results}")
 
 
 @timer
-def with_multi_pool(seconds, processes):
+def with_multi_pool(seconds, processes, executor=None):
     desc_seconds, results = [], []
     for i in range(processes - 1, -1, -1):
         desc_seconds.append(seconds + i)
 
-    with concurrent.futures.ProcessPoolExecutor() as executor:
+    if executor is not None:
         process_list = [executor.submit(sleep_for, s) for s in desc_seconds]
+    else:
+        with concurrent.futures.ProcessPoolExecutor() as fresh:
+            process_list = [fresh.submit(sleep_for, s) for s in desc_seconds]
 
     for p in concurrent.futures.as_completed(process_list):
         results.append(p.result())
     print(f"pids: {results}")
 
 
+@timer
+def with_worker_pool(seconds, processes, pool):
+    # Results stream back in order of completion
+    asc_seconds = [seconds + i for i in range(processes)]
+    results = list(pool.imap_unordered(sleep_for, asc_seconds))
+    print(f"pids: {results}")
+
+
+_barrier = None
+
+
+def _init_worker(barrier, initializer, initargs):
+    global _barrier
+    _barrier = barrier
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _warm(_):
+    # Blocks until every worker holds one: all started and initialized
+    _barrier.wait()
+    return os.getpid()
+
+
+def _noop(x):
+    return x
+
+
+class WorkerPool:
+    """A multiprocessing.Pool started once, warmed, and reused across calls.
+
+    Every worker has started (with the given start method) and run its
+    initializer before __init__ returns; spawn_time is what that cost.
+    """
+
+    def __init__(self, processes=None, method=None, initializer=None, initargs=()):
+        self.processes = processes or os.cpu_count()
+        self.context = multiprocessing.get_context(method)
+        start = time.perf_counter()
+        # Forked workers must share our resource tracker: one of their own
+        # would unlink shared_memory they attach to when they exit
+        resource_tracker.ensure_running()
+        barrier = self.context.Barrier(self.processes)
+        self.pool = self.context.Pool(
+            self.processes, _init_worker, (barrier, initializer, initargs)
+        )
+        self.pids = self.pool.map(_warm, range(self.processes), chunksize=1)
+        self.spawn_time = time.perf_counter() - start
+
+    def chunksize(self, items):
+        # Pool.map's heuristic: ~4 chunks per worker; 1 for unsized iterables
+        try:
+            n = len(items)
+        except TypeError:
+            return 1
+        chunksize, extra = divmod(n, self.processes * 4)
+        return max(1, chunksize + bool(extra))
+
+    def map(self, func, items, chunksize=None):
+        return self.pool.map(func, items, chunksize or self.chunksize(items))
+
+    def imap_unordered(self, func, items, chunksize=None):
+        return self.pool.imap_unordered(
+            func, items, chunksize or self.chunksize(items)
+        )
+
+    def dispatch_latency(self, n=200):
+        # Round trip of one no-op task at a time (seconds, mean and p99)
+        times = []
+        for i in range(n):
+            start = time.perf_counter()
+            self.pool.apply_async(_noop, (i,)).get()
+            times.append(time.perf_counter() - start)
+        times.sort()
+        return statistics.fmean(times), times[int(0.99 * (n - 1))]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _reverse_pickled(chunk):
+    # chunk and the reversed copy both travel through the pool's pipes
+    reversed_chunk = chunk[::-1]
+    return sum(chunk), reversed_chunk
+
+
+def _reverse_shared(handles):
+    # Only the handles travel: the worker reads and writes shared memory
+    source_handle, target_handle = handles
+    with attach(source_handle) as source, attach(target_handle) as target:
+        target[:] = source[::-1]
+        return sum(source)
+
+
+@timer
+def with_pickled(data, pool):
+    chunk = -(-len(data) // pool.processes)
+    chunks = [data[i : i + chunk] for i in range(0, len(data), chunk)]
+    results = pool.map(_reverse_pickled, chunks, chunksize=1)
+    output = array.array(data.typecode)
+    for _, reversed_chunk in results:
+        output += reversed_chunk
+    print(f"sum: {sum(total for total, _ in results):,.0f}")
+    return output
+
+
+@timer
+def with_shared_memory(data, pool):
+    with SharedArena(2 * len(data) * data.itemsize) as arena:
+        source = arena.put(data)
+        target = arena.alloc(source.shape, source.format)
+        tasks = zip(split(source, pool.processes), split(target, pool.processes))
+        totals = pool.map(_reverse_shared, list(tasks), chunksize=1)
+        print(f"sum: {sum(totals):,.0f}")
+        with arena.view(target) as view:
+            return array.array(data.typecode, view.tobytes())
+
+
+def compare_transports(size_mb, pool):
+    data = array.array("d", range(size_mb * 1024 * 1024 // 8))
+    pickled = with_pickled(data, pool)
+    shared = with_shared_memory(data, pool)
+    assert pickled == shared
+
+
+def measure(processes, n_tasks=100_000):
+    print(
+        f"{'method':<11}| {'spawn+warm':>10} | {'dispatch mean / p99':>20}"
+        f" | {'no-ops/s (auto chunks)':>22} | {'fresh Pool per call':>19}"
+    )
+    for method in multiprocessing.get_all_start_methods():
+        with WorkerPool(processes, method) as pool:
+            mean, p99 = pool.dispatch_latency()
+            start = time.perf_counter()
+            for _ in pool.imap_unordered(_noop, range(n_tasks)):
+                pass
+            rate = n_tasks / (time.perf_counter() - start)
+        # What with_multi used to pay on every call
+        start = time.perf_counter()
+        with multiprocessing.get_context(method).Pool(processes) as fresh:
+            fresh.map(_noop, range(processes))
+            fresh.close()
+            fresh.join()
+        fresh_time = time.perf_counter() - start
+        print(
+            f"{method:<11}| {pool.spawn_time * 1e3:>7.1f} ms"
+            f" | {mean * 1e6:>7.0f} / {p99 * 1e6:>6.0f} us"
+            f" | {rate:>22,.0f} | {fresh_time * 1e3:>16.1f} ms"
+        )
+
+
 def main():
     args = cli()
+    if args.measure:
+        measure(args.processes)
+        return
+    if args.shm:
+        with WorkerPool(args.processes, args.method) as pool:
+            compare_transports(args.shm, pool)
+        return
     no_multi(args.seconds, args.processes)
     with_multi(args.seconds, args.processes)
     with_multi_pool(args.seconds, args.processes)
 
+    # Started once (spawn/import paid here, not per call), then reused
+    level = logging.getLogger().level
+    with WorkerPool(
+        args.processes, args.method, configure_logging, (level,)
+    ) as pool:
+        print(f"WorkerPool warm in {pool.spawn_time:.2f} seconds")
+        with_multi(args.seconds, args.processes, pool.pool)
+        with_worker_pool(args.seconds, args.processes, pool)
+
 
 if __name__ == "__main__":
     main()
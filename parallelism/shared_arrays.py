@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""Arrays in multiprocessing.shared_memory, passed to workers as handles."""
+
+import collections
+import math
+import struct
+from multiprocessing import shared_memory
+
+# Pickles to a few dozen bytes, whatever the array's size
+Handle = collections.namedtuple("Handle", "name offset shape format")
+
+ALIGN = 64
+MAX_ATTACHED = 8
+
+_attached = collections.OrderedDict()
+
+
+def nbytes(shape, format):
+    return math.prod(shape) * struct.calcsize(format)
+
+
+def _cast(buf, handle):
+    size = nbytes(handle.shape, handle.format)
+    view = buf[handle.offset : handle.offset + size]
+    return view.cast(handle.format, handle.shape)
+
+
+def _open(name):
+    try:
+        # 3.13+: an attaching process must not register the segment
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Earlier: it registers it again with the resource tracker it
+        # shares with its parent, where the name is already registered
+        return shared_memory.SharedMemory(name)
+
+
+def attach(handle):
+    """memoryview of the handle's array (its format and shape), no copy.
+
+    Segments stay mapped in this process for later tasks (up to
+    MAX_ATTACHED of them, least recently used closed first).
+    """
+    shm = _attached.pop(handle.name, None) or _open(handle.name)
+    _attached[handle.name] = shm
+    while len(_attached) > MAX_ATTACHED:
+        name, old = _attached.popitem(last=False)
+        try:
+            old.close()
+        except BufferError:
+            # Still viewed: keep it mapped
+            _attached[name] = old
+            break
+    return _cast(shm.buf, handle)
+
+
+def split(handle, n):
+    # Up to n handles over consecutive slices of the first axis
+    rows = handle.shape[0]
+    row_bytes = nbytes(handle.shape[1:], handle.format)
+    step = -(-rows // n)
+    for start in range(0, rows, step):
+        stop = min(start + step, rows)
+        yield handle._replace(
+            offset=handle.offset + start * row_bytes,
+            shape=(stop - start,) + tuple(handle.shape[1:]),
+        )
+
+
+class SharedArena:
+    """One shared_memory segment carved into arrays by a bump allocator.
+
+    The creating process owns it: close() (or leaving the with block, even
+    on an exception) unlinks it. Creating registers it with the resource
+    tracker, which unlinks it if the owner dies without doing so, so no
+    /dev/shm entry outlives a crash.
+    """
+
+    def __init__(self, size):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.used = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def alloc(self, shape, format="d"):
+        offset = -(-self.used // ALIGN) * ALIGN
+        size = nbytes(shape, format)
+        if offset + size > self.shm.size:
+            raise MemoryError(
+                f"{self.shm.name}: {size:,} bytes don't fit"
+                f" ({self.shm.size - offset:,} free)"
+            )
+        self.used = offset + size
+        return Handle(self.shm.name, offset, tuple(shape), format)
+
+    def put(self, data, shape=None):
+        # Copies a buffer (array.array, bytes, memoryview...) in, once
+        with memoryview(data) as source:
+            handle = self.alloc(shape or source.shape, source.format)
+            with self.view(handle) as target:
+                target.cast("B")[:] = source.cast("B")
+        return handle
+
+    def view(self, handle):
+        return _cast(self.shm.buf, handle)
+
+    def close(self):
+        try:
+            self.shm.unlink()
+        finally:
+            try:
+                self.shm.close()
+            except BufferError:
+                # A view is still alive: the mapping goes when it does
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+
+"""Keyed pickles in one append-only data file, found through a hash index."""
+
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import random
+import statistics
+import struct
+import tempfile
+import time
+import zlib
+from array import array
+
+from utils import CallStats
+
+DATA_MAGIC = b"OBJSTORD"
+INDEX_MAGIC = b"OBJSTORI"
+# magic, generation (bumped by every compaction)
+DATA_HEADER = struct.Struct("<8sQ")
+# magic, generation, data bytes indexed, live keys, used slots, garbage
+# bytes, capacity
+INDEX_HEADER = struct.Struct("<8s6Q")
+# crc32 of key and value, key length, value length
+RECORD = struct.Struct("<III")
+# Value length of a delete
+TOMBSTONE = 0xFFFFFFFF
+# Offset of a deleted slot, which probes must go past
+DELETED = 2**64 - 1
+MIN_CAPACITY = 1024
+BATCH_BYTES = 1024 * 1024
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--testrun", help="main() example", action="store_true")
+    parser.add_argument(
+        "--bench",
+        help="put N objects then time random gets, for each N",
+        metavar="N",
+        nargs="+",
+        type=int,
+    )
+    parser.add_argument(
+        "--lookups", help="random gets per store size", default=10_000, type=int
+    )
+    parser.add_argument(
+        "--dir", help="where to create the benchmark's stores (default: temp)"
+    )
+
+    format = "%(levelname)-5s | %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO)
+    return parser.parse_args()
+
+
+def _hash(key):
+    # Stable across processes, unlike hash(); never 0, which marks a free slot
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def _capacity(keys):
+    # Power of two, at most two thirds full
+    capacity = MIN_CAPACITY
+    while keys * 3 > capacity * 2:
+        capacity *= 2
+    return capacity
+
+
+def _pwrite_all(fd, data, offset):
+    with memoryview(data) as view:
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ObjectStore:
+    """Pickled objects by str key, in PATH.data and PATH.index.
+
+    PATH.data is a header then records (header, key, pickled value), only
+    ever appended to. PATH.index is an open-addressing hash table of
+    record offsets and sizes, in three arrays. get() probes the table
+    (usually a single slot) and reads its record with one pread(), so a
+    lookup costs the same with 1k keys or 10M.
+
+    put_many() writes its records about BATCH_BYTES at a time and fsyncs
+    once at the end (put() is a batch of one). An overwrite or a delete
+    leaves the old record in the data file until compact() rewrites it.
+
+    The index is saved by flush() and close(). On open, records appended
+    after it was saved are indexed by scanning the data file's tail, and
+    a torn or corrupt last record is cut off. An index left behind by an
+    interrupted compact() doesn't match the data file's generation, so
+    it is rebuilt from a full scan.
+    """
+
+    def __init__(self, path, sync=True):
+        self.data_path = f"{path}.data"
+        self.index_path = f"{path}.index"
+        self.sync = sync
+        self.fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._open()
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def _open(self):
+        header = os.pread(self.fd, DATA_HEADER.size, 0)
+        if len(header) < DATA_HEADER.size:
+            # New (or torn before its header was written)
+            header = DATA_HEADER.pack(DATA_MAGIC, 0)
+            os.ftruncate(self.fd, 0)
+            _pwrite_all(self.fd, header, 0)
+        magic, self.generation = DATA_HEADER.unpack(header)
+        if magic != DATA_MAGIC:
+            raise ValueError(f"{self.data_path} isn't an object store")
+        self.size = os.fstat(self.fd).st_size
+        indexed = self._load_index()
+        if indexed is None:
+            if os.path.exists(self.index_path):
+                logging.warning(f"{self.index_path} is stale: rebuilding it")
+            self._reset_index(MIN_CAPACITY)
+            indexed = DATA_HEADER.size
+        self._scan(indexed)
+
+    def _reset_index(self, capacity):
+        self.capacity = capacity
+        self.hashes = array("Q", bytes(8 * capacity))
+        self.offsets = array("Q", bytes(8 * capacity))
+        self.sizes = array("I", bytes(4 * capacity))
+        self.live = self.used = self.garbage = 0
+
+    def _load_index(self):
+        # Data bytes the saved index covers, or None if there's no usable one
+        try:
+            with open(self.index_path, "rb") as f:
+                header = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                magic, generation, indexed, *counts, capacity = header
+                if (
+                    magic != INDEX_MAGIC
+                    or generation != self.generation
+                    or indexed > self.size
+                ):
+                    return None
+                arrays = array("Q"), array("Q"), array("I")
+                for a in arrays:
+                    a.fromfile(f, capacity)
+        except (FileNotFoundError, struct.error, EOFError):
+            return None
+        self.hashes, self.offsets, self.sizes = arrays
+        self.live, self.used, self.garbage = counts
+        self.capacity = capacity
+        return indexed
+
+    def _save_index(self):
+        # Native byte order: the index is rebuilt rather than moved
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(
+                INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    self.generation,
+                    self.size,
+                    self.live,
+                    self.used,
+                    self.garbage,
+                    self.capacity,
+                )
+            )
+            for a in (self.hashes, self.offsets, self.sizes):
+                a.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def _scan(self, offset):
+        good = offset
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            while header := f.read(RECORD.size):
+                if len(header) < RECORD.size:
+                    break
+                crc, key_len, value_len = RECORD.unpack(header)
+                tombstone = value_len == TOMBSTONE
+                length = key_len + (0 if tombstone else value_len)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    break
+                size = RECORD.size + length
+                self._index(body[:key_len], good, size, tombstone)
+                good += size
+        if good < self.size:
+            logging.warning(
+                f"{self.data_path}: cutting off {self.size - good:,} bytes"
+                " of torn or corrupt records"
+            )
+            os.ftruncate(self.fd, good)
+            self.size = good
+
+    def _find(self, key, h, whole=False):
+        """(slot, record) of key, record holding just its header and key
+        unless whole, or (the slot it would go in, None)."""
+        mask = self.capacity - 1
+        i = h & mask
+        free = None
+        while True:
+            slot_hash = self.hashes[i]
+            if not slot_hash:
+                return (i if free is None else free), None
+            offset = self.offsets[i]
+            if offset == DELETED:
+                if free is None:
+                    free = i
+            elif slot_hash == h:
+                size = self.sizes[i] if whole else RECORD.size + len(key)
+                record = os.pread(self.fd, size, offset)
+                _, key_len, _ = RECORD.unpack_from(record)
+                if key_len == len(key) and record[RECORD.size :][:key_len] == key:
+                    return i, record
+            i = (i + 1) & mask
+
+    def _place(self, h, offset, size):
+        # Into the first free slot: only for keys not already in the table
+        mask = self.capacity - 1
+        i = h & mask
+        while self.hashes[i]:
+            i = (i + 1) & mask
+        self.hashes[i] = h
+        self.offsets[i] = offset
+        self.sizes[i] = size
+        self.used += 1
+
+    def _resize(self, capacity):
+        old = self.hashes, self.offsets, self.sizes
+        live = self.live
+        self._reset_index(capacity)
+        self.live = live
+        for h, offset, size in zip(*old):
+            # Deleted slots are left behind
+            if h and offset != DELETED:
+                self._place(h, offset, size)
+
+    def _index(self, key, offset, size, tombstone=False):
+        h = _hash(key)
+        slot, record = self._find(key, h)
+        if record is not None:
+            # Overwritten or deleted: garbage until the next compact()
+            self.garbage += self.sizes[slot]
+        if tombstone:
+            self.garbage += size
+            if record is not None:
+                self.offsets[slot] = DELETED
+                self.live -= 1
+            return
+        if record is None:
+            if not self.hashes[slot]:
+                self.used += 1
+            self.live += 1
+        self.hashes[slot] = h
+        self.offsets[slot] = offset
+        self.sizes[slot] = size
+        if self.used * 3 > self.capacity * 2:
+            self._resize(_capacity(self.live * 2))
+
+    def _append(self, batch, entries):
+        if batch:
+            _pwrite_all(self.fd, batch, self.size)
+            for key, offset, size, tombstone in entries:
+                self._index(key, self.size + offset, size, tombstone)
+            self.size += len(batch)
+
+    def put_many(self, items):
+        # (key, value) pairs: a few large writes, one fsync
+        batch = bytearray()
+        entries = []
+        for key, value in items:
+            key = key.encode()
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            size = RECORD.size + len(key) + len(value)
+            entries.append((key, len(batch), size, False))
+            crc = zlib.crc32(value, zlib.crc32(key))
+            batch += RECORD.pack(crc, len(key), len(value))
+            batch += key
+            batch += value
+            if len(batch) >= BATCH_BYTES:
+                self._append(batch, entries)
+                batch.clear()
+                entries.clear()
+        self._append(batch, entries)
+        if self.sync:
+            os.fsync(self.fd)
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        encoded = key.encode()
+        _, record = self._find(encoded, _hash(encoded), whole=True)
+        if record is None:
+            raise KeyError(key)
+        return pickle.loads(memoryview(record)[RECORD.size + len(encoded) :])
+
+    def __contains__(self, key):
+        encoded = key.encode()
+        return self._find(encoded, _hash(encoded))[1] is not None
+
+    def __len__(self):
+        return self.live
+
+    def __delitem__(self, key):
+        encoded = key.encode()
+        if key not in self:
+            raise KeyError(key)
+        record = RECORD.pack(zlib.crc32(encoded), len(encoded), TOMBSTONE) + encoded
+        self._append(record, [(encoded, 0, len(record), True)])
+        if self.sync:
+            os.fsync(self.fd)
+
+    def compact(self):
+        """Rewrites the data file with only its live records; returns the
+        bytes freed."""
+        before = self.size
+        generation = self.generation + 1
+        # In file order: the old file is read front to back
+        slots = [
+            i
+            for i in range(self.capacity)
+            if self.hashes[i] and self.offsets[i] != DELETED
+        ]
+        slots.sort(key=self.offsets.__getitem__)
+        offsets = array("Q", self.offsets)
+        tmp = f"{self.data_path}.compact"
+        with open(tmp, "wb") as f:
+            f.write(DATA_HEADER.pack(DATA_MAGIC, generation))
+            for i in slots:
+                offsets[i] = f.tell()
+                f.write(os.pread(self.fd, self.sizes[i], self.offsets[i]))
+            size = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.data_path)
+        _fsync_dir(self.data_path)
+        os.close(self.fd)
+        self.fd = os.open(self.data_path, os.O_RDWR)
+        self.generation = generation
+        self.size = size
+        self.offsets = offsets
+        self._resize(_capacity(self.live))
+        self.garbage = 0
+        self._save_index()
+        return before - size
+
+    def flush(self):
+        os.fsync(self.fd)
+        self._save_index()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    path = "test.store"
+    with ObjectStore(path) as store:
+        store.put_many((f"key{i}", {"i": i}) for i in range(1000))
+        store.put("key1", "overwritten")
+        del store["key2"]
+        logging.info(f"{len(store)} keys, {store.garbage:,} bytes of garbage")
+
+    # Reopened: the index is loaded, not rebuilt
+    with ObjectStore(path) as store:
+        print("key1 :", store["key1"])
+        print("key2 :", store.get("key2"))
+        print("key3 :", store["key3"])
+        logging.info(f"Compacting freed {store.compact():,} bytes")
+        print("key999 :", store["key999"])
+
+
+def bench(sizes, lookups, directory):
+    rng = random.Random(0)
+    print(
+        f"{'objects':>10} | {'puts/s':>9} | {'data':>9}"
+        f" | {'get mean / p50 / p99 (µs)':>27}"
+    )
+    stats = CallStats()
+    for n in sizes:
+        with tempfile.TemporaryDirectory(dir=directory) as tmp:
+            with ObjectStore(os.path.join(tmp, "bench")) as store:
+                start = time.perf_counter()
+                for first in range(0, n, 10_000):
+                    store.put_many(
+                        (f"key{i}", {"id": i, "name": f"object {i}"})
+                        for i in range(first, min(first + 10_000, n))
+                    )
+                put_s = time.perf_counter() - start
+
+                keys = [f"key{rng.randrange(n)}" for _ in range(lookups)]
+                times = []
+                for key in keys:
+                    start = time.perf_counter()
+                    store[key]
+                    times.append(time.perf_counter() - start)
+                    stats.record(f"get, {n:,}", 0, times[-1])
+                q = statistics.quantiles(times, n=100)
+                print(
+                    f"{n:>10,} | {n / put_s:>9,.0f} | {store.size / 2**20:>6.1f} MB"
+                    f" | {statistics.fmean(times) * 1e6:>9.1f}"
+                    f" / {q[49] * 1e6:>6.1f} / {q[98] * 1e6:>6.1f}"
+                )
+    stats.dump()
+
+
+if __name__ == "__main__":
+    args = cli()
+    if args.bench:
+        bench(args.bench, args.lookups, args.dir)
+    elif args.testrun:
+        main()
@@ -1,41 +1,165 @@
 #!/usr/bin/env python3
 
 import argparse
+import bisect
 import logging
+import os
 import pickle
+import time
 
 
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument("--testrun", help="main() example", action="store_true")
+    parser.add_argument(
+        "--stats", help="collect call stats and dump them", action="store_true"
+    )
+    parser.add_argument(
+        "--bench",
+        help="time N calls with logging and stats on and off",
+        metavar="N",
+        type=int,
+    )
 
     format = "%(levelname)-5s | %(message)s"
     logging.basicConfig(format=format, level=logging.INFO)
     return parser.parse_args()
 
 
+class CallStats:
+    """Calls, bytes and a latency histogram per function, off by default."""
+
+    # Bucket upper bounds in seconds: 1 µs, 3 µs, 10 µs... 3 s
+    BOUNDS = [m * 10.0**e for e in range(-6, 1) for m in (1, 3)]
+
+    def __init__(self):
+        self.enabled = False
+        self.calls = {}
+
+    def record(self, name, size, elapsed):
+        entry = self.calls.get(name)
+        if entry is None:
+            entry = self.calls[name] = [0, 0, 0.0, [0] * (len(self.BOUNDS) + 1)]
+        entry[0] += 1
+        entry[1] += size
+        entry[2] += elapsed
+        entry[3][bisect.bisect_left(self.BOUNDS, elapsed)] += 1
+
+    def dump(self):
+        for name, (count, size, total, histogram) in self.calls.items():
+            buckets = ", ".join(
+                f"{_bound(i)}: {n}" for i, n in enumerate(histogram) if n
+            )
+            logging.info(
+                "%-17s | %8d calls | %10d bytes | mean %9.1f µs | %s",
+                name,
+                count,
+                size,
+                total / count * 1e6,
+                buckets,
+            )
+
+    def reset(self):
+        self.calls.clear()
+
+
+def _bound(i):
+    if i == len(CallStats.BOUNDS):
+        return f">{CallStats.BOUNDS[-1]:.0f}s"
+    bound = CallStats.BOUNDS[i]
+    if bound < 1e-3:
+        return f"≤{bound * 1e6:.0f}µs"
+    return f"≤{bound * 1e3:.0f}ms" if bound < 1 else f"≤{bound:.0f}s"
+
+
+STATS = CallStats()
+
+
+def _start():
+    # A clock reading only when someone will see the result: logging at
+    # INFO or stats on. None otherwise, and nothing else is done
+    if STATS.enabled or logging.root.isEnabledFor(logging.INFO):
+        return time.perf_counter()
+    return None
+
+
+def _finish(name, size, start, msg, *args):
+    # msg's last argument is the call's duration in µs
+    elapsed = time.perf_counter() - start
+    if STATS.enabled:
+        STATS.record(name, size, elapsed)
+    # Checked here too: logging.info() costs a microsecond even when off
+    if logging.root.isEnabledFor(logging.INFO):
+        logging.info(msg, *args, elapsed * 1e6)
+
+
+# Messages take %-style arguments, so logging only formats them if it
+# emits them, and log an object's type and size: never its repr, which
+# for a large object costs more than pickling it
 def serialize(obj):
+    start = _start()
     pickled = pickle.dumps(obj)
-    logging.info(f"Serialized {obj} to 'pickled' @ {hex(id(pickled))}")
+    if start is not None:
+        _finish(
+            "serialize",
+            len(pickled),
+            start,
+            "Serialized %s (%d bytes) to 'pickled' @ %#x in %.1f µs",
+            type(obj).__name__,
+            len(pickled),
+            id(pickled),
+        )
     return pickled
 
 
 def serialize_write(obj, filename):
+    start = _start()
     with open(filename, "wb") as f:
         pickle.dump(obj, f)
-    logging.info(f"Serialized {obj} to '{filename}'")
+        size = f.tell()
+    if start is not None:
+        _finish(
+            "serialize_write",
+            size,
+            start,
+            "Serialized %s (%d bytes) to '%s' in %.1f µs",
+            type(obj).__name__,
+            size,
+            filename,
+        )
 
 
 def deserialize(pickled):
+    start = _start()
     obj = pickle.loads(pickled)
-    logging.info(f"De-serialized {obj} from 'pickled' @ {hex(id(pickled))}")
+    if start is not None:
+        _finish(
+            "deserialize",
+            len(pickled),
+            start,
+            "De-serialized %s (%d bytes) from 'pickled' @ %#x in %.1f µs",
+            type(obj).__name__,
+            len(pickled),
+            id(pickled),
+        )
     return obj
 
 
 def deserialize_read(filename):
+    start = _start()
     with open(filename, "rb") as f:
         obj = pickle.load(f)
-    logging.info(f"De-serialized {obj} from '{filename}'")
+        size = f.tell()
+    if start is not None:
+        _finish(
+            "deserialize_read",
+            size,
+            start,
+            "De-serialized %s (%d bytes) from '%s' in %.1f µs",
+            type(obj).__name__,
+            size,
+            filename,
+        )
     return obj
 
 
@@ -56,5 +180,70 @@ def main():
     print("var is obj :", var is obj)
 
 
-if __name__ == "__main__" and cli().testrun:
-    main()
+def bench(number):
+    # serialize + deserialize of a small and a large dict: the cost of a
+    # call with everything off, with stats on and with logging on
+    # (formatted and written, to devnull), against the old f-string
+    objects = {
+        "small": {"a": 1, "b": 2},
+        "large": {f"key{i}": list(range(10)) for i in range(10_000)},
+    }
+    root = logging.getLogger()
+    level, handlers = root.level, root.handlers
+    devnull = open(os.devnull, "w")
+
+    def eager(obj):
+        # What every call used to build, logged or not
+        pickled = pickle.dumps(obj)
+        logging.info(f"Serialized {obj} to 'pickled' @ {hex(id(pickled))}")
+        obj = pickle.loads(pickled)
+        logging.info(f"De-serialized {obj} from 'pickled' @ {hex(id(pickled))}")
+
+    def lazy(obj):
+        deserialize(serialize(obj))
+
+    configs = [
+        ("eager f-string, off", eager, logging.WARNING, False),
+        ("off", lazy, logging.WARNING, False),
+        ("stats on", lazy, logging.WARNING, True),
+        ("logging on", lazy, logging.INFO, False),
+        ("eager f-string, on", eager, logging.INFO, False),
+    ]
+    results = []
+    try:
+        root.handlers = [logging.StreamHandler(devnull)]
+        for size, var in objects.items():
+            # Small calls are quick: more of them for a stable timing
+            n = number * 100 if size == "small" else number
+            for name, func, level_, stats in configs:
+                root.setLevel(level_)
+                STATS.enabled = stats
+                func(var)
+                start = time.perf_counter()
+                for _ in range(n):
+                    func(var)
+                results.append((size, name, (time.perf_counter() - start) / n))
+    finally:
+        STATS.enabled = False
+        STATS.reset()
+        root.setLevel(level)
+        root.handlers = handlers
+        devnull.close()
+
+    baselines = {size: t for size, name, t in results if name == "off"}
+    for size, name, per_call in results:
+        logging.info(
+            f"{size:<6}| {name:<20}| {per_call * 1e6:>10.1f} µs/call"
+            f" | {per_call / baselines[size]:>5.2f}x of off"
+        )
+
+
+if __name__ == "__main__":
+    args = cli()
+    STATS.enabled = args.stats
+    if args.bench:
+        bench(args.bench)
+    elif args.testrun:
+        main()
+    if args.stats:
+        STATS.dump()
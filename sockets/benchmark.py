@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""Loopback throughput of server.send_msg -> client.read_msg."""
+
+import argparse
+import logging
+import socket
+import threading
+import time
+
+from client import read_msg
+from server import send_msg
+
+
+KB = 1 << 10
+MB = 1 << 20
+SIZES = [KB, 10 * KB, 100 * KB, MB, 10 * MB, 100 * MB]
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        help="payload sizes (bytes)",
+        nargs="+",
+        default=SIZES,
+        type=int,
+    )
+    parser.add_argument(
+        "-b", "--buffer", help="max bytes per recv", default=65536, type=int
+    )
+    parser.add_argument(
+        "-t",
+        "--total",
+        help="bytes to transfer per payload size",
+        default=256 * MB,
+        type=int,
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+def serve(listener, payload, count):
+    conn, _ = listener.accept()
+    with conn:
+        for _ in range(count):
+            send_msg(conn, payload)
+
+
+def measure(size, count, buffer_size):
+    # Server runs in a thread; pickling on its side is part of the cost
+    payload = bytes(size)
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        sender = threading.Thread(
+            target=serve, args=[listener, payload, count], daemon=True
+        )
+        sender.start()
+        with socket.create_connection(listener.getsockname()) as sock:
+            start = time.perf_counter()
+            for _ in range(count):
+                msg = read_msg(sock, buffer_size)
+                assert len(msg) == size
+            elapsed = time.perf_counter() - start
+        sender.join()
+    return elapsed
+
+
+def main():
+    args = cli()
+    print(f"{'size':>12} | {'msgs':>6} | {'seconds':>8} | {'MB/s':>9}")
+    for size in args.sizes:
+        count = max(1, args.total // size)
+        logging.info(f"Sending {count} x {size} bytes...")
+        elapsed = measure(size, count, args.buffer)
+        rate = size * count / elapsed / MB
+        print(f"{size:>12,} | {count:>6} | {elapsed:>8.3f} | {rate:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
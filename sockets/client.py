@@ -2,11 +2,9 @@
 
 import argparse
 import logging
-import pickle
 import socket
 
-
-HEADER_SIZE = 20
+from protocol import CODECS, Stats, handshake, read_msg
 
 
 def cli():
@@ -14,7 +12,15 @@ def cli():
     parser.add_argument("IPv4", help="IPv4 address to connect to")
     parser.add_argument("PORT", help="port number to connect to", type=int)
     parser.add_argument(
-        "-b", "--buffer", help="buffer size (bytes)", default=8, type=int
+        "-b", "--buffer", help="max bytes per recv", default=65536, type=int
+    )
+    parser.add_argument(
+        "-c",
+        "--compress",
+        help="codecs the server may use, in order of preference",
+        nargs="*",
+        default=list(CODECS),
+        choices=CODECS,
     )
     parser.add_argument(
         "-q", "--quiet", help="only show warnings and errors", action="store_true"
@@ -27,31 +33,24 @@ def cli():
     return args
 
 
-def read_msg(sock, buffer_size):
-    header = sock.recv(HEADER_SIZE)
-    msg_len = int(header.decode("utf-8"))
-
-    msg = b""
-    while len(msg) < msg_len:
-        bytes_to_read = min(buffer_size, msg_len - len(msg))
-        msg += sock.recv(bytes_to_read)
-    return pickle.loads(msg)
-
-
 def main():
     args = cli()
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     address_port = (args.IPv4, args.PORT)
     logging.info(f"Connecting to {address_port}...")
     s.connect(address_port)
+    compression = handshake(s, args.compress, args.buffer)
+    logging.info(f"Server will send codec {compression.codec}")
 
+    stats = Stats()
     while True:
         try:
-            msg = read_msg(s, args.buffer)
+            msg = read_msg(s, args.buffer, stats)
         except:
             break
         else:
             print(f"{address_port[0]}:{address_port[1]} > {msg}")
+    logging.info(f"Received: {stats}")
 
 
 if __name__ == "__main__":
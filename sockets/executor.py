@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+
+"""concurrent.futures.Executor whose workers connect over TCP (protocol.py).
+
+Messages (tuples, framed and pickled by protocol.py), after the handshake:
+    worker -> coordinator   ("ready", slots, prefetch)  ("heartbeat",)
+                            ("result", id, ok, value)   ("dropped", id)
+    coordinator -> worker   ("task", id, call)  ("drop", id)  ("stop",)
+
+call is (fn, args, kwargs) pickled on its own, so a worker that can't
+unpickle it (fn not importable there) still knows which task failed.
+
+Dispatch is pull-based: a worker holds `slots + prefetch` credits and gets
+one credit back per result, so fast workers take more tasks. Once the queue
+is empty an idle worker steals a prefetched, not yet started task from the
+busiest worker (which is told to drop it). Tasks of a worker that
+disconnects, or misses heartbeats for `timeout` seconds, are re-queued.
+Tasks may therefore run more than once: the first result wins.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+import pickle
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from protocol import CODECS, dumps, handshake, loads, read_msg, send_msg
+from server import EventServer
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="run a worker")
+    worker.add_argument("IPv4", help="coordinator address")
+    worker.add_argument("PORT", help="coordinator port", type=int)
+    worker.add_argument(
+        "-s", "--slots", help="tasks run at once (threads)", default=1, type=int
+    )
+    worker.add_argument(
+        "-p", "--prefetch", help="tasks queued ahead of the slots", default=1, type=int
+    )
+    worker.add_argument(
+        "--heartbeat", help="seconds between heartbeats", default=1.0, type=float
+    )
+    worker.add_argument(
+        "-c",
+        "--compress",
+        help="codecs the coordinator may use, in order of preference",
+        nargs="*",
+        default=[],
+        choices=CODECS,
+    )
+
+    demo = commands.add_parser("demo", help="coordinator + local worker processes")
+    demo.add_argument("-w", "--workers", help="worker processes", default=4, type=int)
+    demo.add_argument("-n", "--tasks", help="tasks to run", default=200, type=int)
+    demo.add_argument(
+        "--kill", help="SIGKILL one worker halfway through", action="store_true"
+    )
+    demo.add_argument(
+        "--stall",
+        help="SIGSTOP one worker halfway through (caught by heartbeats)",
+        action="store_true",
+    )
+
+    for sub in (worker, demo):
+        sub.add_argument(
+            "-q", "--quiet", help="only show warnings and errors", action="store_true"
+        )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+class Task:
+    def __init__(self, future, pickled):
+        self.future = future
+        # The ("task", ...) message, pickled once by submit()
+        self.pickled = pickled
+        self.owners = set()
+        self.started = False
+
+
+class WorkerState:
+    def __init__(self):
+        self.slots = 0
+        self.credits = 0
+        # Task ids in the order they were sent
+        self.assigned = {}
+        self.done = 0
+        self.last_seen = time.monotonic()
+
+
+class Coordinator(EventServer):
+    """EventServer whose clients are workers pulling tasks (see module doc).
+
+    All state lives on the loop thread: other threads go through
+    submit_task()/cancel_pending()/reap().
+    """
+
+    def __init__(self, address_port, timeout=5.0, codecs=()):
+        super().__init__(address_port, codecs)
+        self.timeout = timeout
+        self.tasks = {}
+        self.pending = collections.deque()
+        self.workers = {}
+        self.stats = collections.Counter()
+
+    def submit_task(self, task_id, future, pickled):
+        self._call(self._enqueue, task_id, Task(future, pickled))
+
+    def cancel_pending(self):
+        self._call(self._cancel_pending)
+
+    def reap(self):
+        self._call(self._reap)
+
+    def handle_connect(self, conn):
+        self.workers[conn.address] = WorkerState()
+        logging.info(f"Worker {conn.address} joined")
+
+    def handle_message(self, conn, msg):
+        worker = self.workers.get(conn.address)
+        if worker is None:
+            return
+        worker.last_seen = time.monotonic()
+        kind = msg[0]
+        if kind == "ready":
+            _, worker.slots, prefetch = msg
+            worker.credits += worker.slots + prefetch
+        elif kind == "result":
+            _, task_id, ok, value = msg
+            worker.credits += 1
+            worker.done += 1
+            worker.assigned.pop(task_id, None)
+            self._resolve(task_id, ok, value)
+        elif kind == "dropped":
+            worker.credits += 1
+        self._dispatch()
+
+    def handle_close(self, conn):
+        worker = self.workers.pop(conn.address, None)
+        if worker is None:
+            return
+        requeued = 0
+        # Back to the front, in their original order
+        for task_id in reversed(worker.assigned):
+            task = self.tasks.get(task_id)
+            if task is None:
+                continue
+            task.owners.discard(conn.address)
+            if not task.owners:
+                self.pending.appendleft(task_id)
+                requeued += 1
+        self.stats["requeued"] += requeued
+        log = logging.warning if requeued else logging.info
+        log(
+            f"Worker {conn.address} left after {worker.done} tasks;"
+            f" {requeued} re-queued"
+        )
+        self._dispatch()
+
+    def _enqueue(self, task_id, task):
+        self.tasks[task_id] = task
+        self.pending.append(task_id)
+        self._dispatch()
+
+    def _cancel_pending(self):
+        # Re-queued tasks have started (their futures are running): kept
+        kept = collections.deque()
+        for task_id in self.pending:
+            task = self.tasks.get(task_id)
+            if task is None:
+                continue
+            if task.started:
+                kept.append(task_id)
+            else:
+                del self.tasks[task_id]
+                task.future.cancel()
+        self.pending = kept
+
+    def _reap(self):
+        deadline = time.monotonic() - self.timeout
+        for address, worker in list(self.workers.items()):
+            if worker.last_seen < deadline:
+                logging.warning(f"Worker {address} missed its heartbeats")
+                self.stats["timed_out"] += 1
+                self._close_address(address)
+
+    def _resolve(self, task_id, ok, value):
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            # Already resolved by another copy (stolen or re-queued)
+            self.stats["duplicates"] += 1
+            return
+        for address in task.owners:
+            worker = self.workers.get(address)
+            if worker:
+                worker.assigned.pop(task_id, None)
+        if ok:
+            task.future.set_result(value)
+        else:
+            task.future.set_exception(value)
+
+    def _next_task(self, thief):
+        # (task id, victim address) from the queue, or stolen from a worker
+        # for thief if it's idle: a busy thief would only prefetch the task,
+        # and the two would pass it back and forth
+        while self.pending:
+            task_id = self.pending.popleft()
+            task = self.tasks.get(task_id)
+            if task is None:
+                continue
+            if not task.started:
+                if not task.future.set_running_or_notify_cancel():
+                    del self.tasks[task_id]
+                    continue
+                task.started = True
+            return task_id, None
+        worker = self.workers[thief]
+        if len(worker.assigned) >= worker.slots:
+            return None, None
+        # Steal the newest prefetched task from the most loaded worker
+        victim, state = max(
+            ((a, w) for a, w in self.workers.items() if a != thief),
+            key=lambda item: len(item[1].assigned) - item[1].slots,
+            default=(None, None),
+        )
+        if victim is None or len(state.assigned) <= state.slots:
+            return None, None
+        task_id = next(reversed(state.assigned))
+        del state.assigned[task_id]
+        self.tasks[task_id].owners.discard(victim)
+        return task_id, victim
+
+    def _dispatch(self):
+        while True:
+            ready = [item for item in self.workers.items() if item[1].credits]
+            if not ready:
+                return
+            address, worker = max(ready, key=lambda item: item[1].credits)
+            task_id, victim = self._next_task(address)
+            if task_id is None:
+                return
+            if victim is not None:
+                self.stats["stolen"] += 1
+                self._deliver([victim], dumps(("drop", task_id)))
+            task = self.tasks[task_id]
+            task.owners.add(address)
+            worker.assigned[task_id] = None
+            worker.credits -= 1
+            self._deliver([address], task.pickled)
+
+    def log_stats(self):
+        print(
+            f"Coordinator: {self.stats['stolen']} stolen,"
+            f" {self.stats['requeued']} re-queued, {self.stats['timed_out']}"
+            f" timed out, {self.stats['duplicates']} duplicate results"
+        )
+
+
+class RemoteExecutor(concurrent.futures.Executor):
+    """Runs submitted calls on whichever workers connect to address.
+
+    fn, args and the results are pickled: fn must be importable by the
+    workers (module-level, same module path).
+    """
+
+    def __init__(
+        self, address_port=("127.0.0.1", 0), heartbeat=1.0, timeout=5.0, codecs=()
+    ):
+        self.coordinator = Coordinator(address_port, timeout, codecs)
+        self.loop = threading.Thread(
+            target=self.coordinator.serve_forever, daemon=True
+        )
+        self.loop.start()
+        self._stop_reaper = threading.Event()
+        self.reaper = threading.Thread(
+            target=self._reap_every, args=[heartbeat], daemon=True
+        )
+        self.reaper.start()
+        self._ids = itertools.count()
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    @property
+    def address(self):
+        return self.coordinator.address
+
+    def _reap_every(self, interval):
+        while not self._stop_reaper.wait(interval):
+            self.coordinator.reap()
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        # Pickled first, in the caller's thread: an unpicklable call raises
+        # here, before there's a future that nothing would ever resolve
+        task_id = next(self._ids)
+        stream, buffers = dumps((fn, args, kwargs))
+        # Out-of-band buffers stay out of band in the message
+        call = (bytes(stream), [pickle.PickleBuffer(buf) for buf in buffers])
+        pickled = dumps(("task", task_id, call))
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        self.coordinator.submit_task(task_id, future, pickled)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+        if cancel_futures:
+            self.coordinator.cancel_pending()
+        if wait:
+            self._finish()
+        else:
+            threading.Thread(target=self._finish, daemon=True).start()
+
+    def _finish(self):
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+        self._stop_reaper.set()
+        self.coordinator.broadcast(("stop",))
+        self.coordinator.stop()
+        self.loop.join()
+
+
+def run_worker(address_port, slots=1, prefetch=1, heartbeat=1.0, codecs=()):
+    sock = socket.create_connection(address_port)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    handshake(sock, codecs)
+    send_lock = threading.Lock()
+    queue = collections.deque()
+    ready = threading.Condition()
+    stopping = threading.Event()
+
+    def send(msg):
+        with send_lock:
+            send_msg(sock, msg)
+
+    def run_tasks():
+        while True:
+            with ready:
+                ready.wait_for(lambda: queue or stopping.is_set())
+                if stopping.is_set():
+                    return
+                task_id, call = queue.popleft()
+            try:
+                # Unpickled here: an error doing so fails this task only
+                fn, args, kwargs = loads(*call)
+                result = ("result", task_id, True, fn(*args, **kwargs))
+            except Exception as e:
+                result = ("result", task_id, False, e)
+            try:
+                send(result)
+            except OSError:
+                return
+            except Exception as e:
+                # The result (or exception) didn't pickle
+                send(("result", task_id, False, RuntimeError(repr(e))))
+
+    def beat():
+        while not stopping.wait(heartbeat):
+            try:
+                send(("heartbeat",))
+            except OSError:
+                return
+
+    threads = [threading.Thread(target=run_tasks, daemon=True) for _ in range(slots)]
+    threads.append(threading.Thread(target=beat, daemon=True))
+    for thread in threads:
+        thread.start()
+    send(("ready", slots, prefetch))
+    try:
+        while True:
+            msg = read_msg(sock)
+            if msg[0] == "task":
+                with ready:
+                    queue.append(msg[1:])
+                    ready.notify()
+            elif msg[0] == "drop":
+                with ready:
+                    queued = [task for task in queue if task[0] == msg[1]]
+                    for task in queued:
+                        queue.remove(task)
+                if queued:
+                    send(("dropped", msg[1]))
+            elif msg[0] == "stop":
+                break
+    except (ConnectionError, OSError):
+        logging.warning("Lost the coordinator")
+    finally:
+        stopping.set()
+        with ready:
+            ready.notify_all()
+        sock.close()
+
+
+def burn(n):
+    # CPU-bound demo task; returns (n, checksum, worker pid)
+    x = 0
+    for i in range(n):
+        x = (x * 31 + i) & 0xFFFFFFFF
+    return n, x, os.getpid()
+
+
+def demo(n_workers, n_tasks, kill=False, stall=False):
+    executor = RemoteExecutor(heartbeat=0.5, timeout=2.0)
+    host, port = executor.address
+    command = [sys.executable, os.path.abspath(__file__), "worker", host, str(port)]
+    command += ["--heartbeat", "0.5", "-q"]
+    workers = [subprocess.Popen(command) for _ in range(n_workers)]
+    start = time.perf_counter()
+    futures = [executor.submit(burn, 50_000 + 1000 * (i % 50)) for i in range(n_tasks)]
+    if kill or stall:
+        concurrent.futures.wait(futures[: n_tasks // 2])
+        if kill:
+            logging.info(f"Killing worker {workers[0].pid}")
+            workers[0].kill()
+        if stall:
+            logging.info(f"Stopping worker {workers[-1].pid}")
+            workers[-1].send_signal(signal.SIGSTOP)
+
+    by_pid = collections.Counter(future.result()[2] for future in futures)
+    elapsed = time.perf_counter() - start
+    print(f"{n_tasks} tasks in {elapsed:.2f} seconds on {len(by_pid)} workers")
+    for pid, count in sorted(by_pid.items()):
+        print(f"  worker {pid}: {count} tasks")
+    executor.shutdown()
+    executor.coordinator.log_stats()
+    for worker in workers:
+        if stall:
+            worker.send_signal(signal.SIGCONT)
+        try:
+            worker.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+
+def main():
+    args = cli()
+    if args.command == "worker":
+        run_worker(
+            (args.IPv4, args.PORT),
+            args.slots,
+            args.prefetch,
+            args.heartbeat,
+            args.compress,
+        )
+    else:
+        demo(args.workers, args.tasks, args.kill, args.stall)
+
+
+if __name__ == "__main__":
+    main()
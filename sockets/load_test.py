@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""Load generator: N loopback clients receiving EventServer broadcasts."""
+
+import argparse
+import logging
+import resource
+import selectors
+import socket
+import statistics
+import threading
+import time
+
+from protocol import CODECS, MsgReader, Stats, handshake
+from server import EventServer
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-c", "--clients", help="concurrent clients", default=1000, type=int
+    )
+    parser.add_argument(
+        "-m", "--messages", help="broadcasts to send", default=100, type=int
+    )
+    parser.add_argument(
+        "-s", "--size", help="payload size (bytes)", default=256, type=int
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        help="broadcasts per second (0: as fast as possible)",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        help="codecs the server offers, in order of preference",
+        nargs="+",
+        default=[],
+        choices=CODECS,
+    )
+    parser.add_argument(
+        "-q", "--quiet", help="only show warnings and errors", action="store_true"
+    )
+    args = parser.parse_args()
+
+    format = "%(levelname)-5s | %(message)s"
+    level = logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format=format, level=level)
+    return args
+
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    return soft
+
+
+class Clients:
+    """All client sockets, read from one selector thread."""
+
+    def __init__(self, address, n_clients, n_messages):
+        self.n_messages = n_messages
+        self.selector = selectors.DefaultSelector()
+        self.latencies = []
+        self.received_bytes = 0
+        self.stats = Stats()
+        self.connected = threading.Event()
+        self.finished = threading.Event()
+        self._welcomed = 0
+        self._done = 0
+        self._expected = n_clients
+        self._counts = {}
+
+        for _ in range(n_clients):
+            sock = socket.create_connection(address)
+            handshake(sock, list(CODECS))
+            sock.setblocking(False)
+            reader = MsgReader(stats=self.stats)
+            self.selector.register(sock, selectors.EVENT_READ, reader)
+            self._counts[sock] = 0
+
+    def run(self):
+        while self._done < self._expected:
+            for key, _ in self.selector.select(timeout=1):
+                self._read(key.fileobj, key.data)
+        self.finished.set()
+
+    def _read(self, sock, reader):
+        msgs = reader.recv(sock)
+        now = time.perf_counter()
+        for msg in msgs:
+            if not isinstance(msg, tuple):
+                # Welcome message sent by EventServer.handle_connect()
+                self._welcomed += 1
+                if self._welcomed == self._expected:
+                    self.connected.set()
+                continue
+            seq, sent_at, payload = msg
+            self.latencies.append(now - sent_at)
+            self.received_bytes += len(payload)
+            self._counts[sock] += 1
+            if self._counts[sock] == self.n_messages:
+                self._done += 1
+        if reader.eof:
+            logging.warning("Server closed a client connection")
+            self.selector.unregister(sock)
+            sock.close()
+            self._done += 1
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+
+
+def percentile(sorted_vals, pct):
+    index = min(len(sorted_vals) - 1, int(len(sorted_vals) * pct / 100))
+    return sorted_vals[index]
+
+
+def main():
+    args = cli()
+    raise_fd_limit(2 * args.clients + 64)
+
+    server = EventServer(("127.0.0.1", 0), args.compress)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    logging.info(f"Connecting {args.clients} clients to {server.address}...")
+    clients = Clients(server.address, args.clients, args.messages)
+    client_thread = threading.Thread(target=clients.run)
+    client_thread.start()
+    clients.connected.wait()
+
+    logging.info(f"Broadcasting {args.messages} x {args.size} bytes...")
+    payload = bytes(args.size)
+    interval = 1 / args.rate if args.rate else 0
+    start = time.perf_counter()
+    for seq in range(args.messages):
+        server.broadcast((seq, time.perf_counter(), payload))
+        if interval:
+            time.sleep(max(0, start + (seq + 1) * interval - time.perf_counter()))
+    clients.finished.wait()
+    elapsed = time.perf_counter() - start
+
+    server.stop()
+    server_thread.join()
+    client_thread.join()
+    clients.close()
+
+    delivered = len(clients.latencies)
+    lat = sorted(clients.latencies)
+    print(f"clients: {args.clients}, broadcasts: {args.messages}")
+    print(f"delivered {delivered:,} msgs in {elapsed:.3f} seconds")
+    print(f"throughput: {delivered / elapsed:,.0f} msgs/s, ", end="")
+    print(f"{clients.received_bytes / elapsed / (1 << 20):.1f} MB/s (payload)")
+    print(f"received: {clients.stats}")
+    if lat:
+        ms = [1000 * percentile(lat, p) for p in (50, 90, 99, 99.9)]
+        print(
+            f"latency ms: mean {1000 * statistics.fmean(lat):.2f}"
+            f" | p50 {ms[0]:.2f} | p90 {ms[1]:.2f}"
+            f" | p99 {ms[2]:.2f} | p99.9 {ms[3]:.2f} | max {1000 * lat[-1]:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+"""Binary message framing shared by server.py and client.py.
+
+Frame layout (network byte order):
+    header   version:B  flags:B  n_buffers:H  payload_len:Q
+    lengths  n_buffers x Q        sizes of the out-of-band buffers
+    raw      (n_buffers + 1) x Q  uncompressed sizes, only if compressed
+    payload  pickle (protocol 5) stream
+    buffers  raw out-of-band buffers, in order
+
+The low bits of flags name the codec (zlib/bz2/lzma) the payload and each
+buffer were compressed with, each one separately. Which codec a sender may use
+is agreed per connection by handshake(); messages below the threshold, or
+that don't shrink, go out uncompressed.
+
+Large bytes/bytearray/array.array objects (and anything else that pickles
+through PickleBuffer, e.g. NumPy arrays) are not copied into the pickle stream:
+they are sent straight from their own memory as out-of-band buffers, and
+received into freshly allocated bytearrays that the unpickled objects reuse.
+"""
+
+import array
+import bz2
+import collections
+import io
+import itertools
+import lzma
+import pickle
+import struct
+import sys
+import time
+import zlib
+
+
+VERSION = 1
+HEADER = struct.Struct("!BBHQ")
+MAX_BUFFERS = 0xFFFF
+# Smaller objects are cheaper to copy into the pickle stream
+OOB_THRESHOLD = 64 << 10
+# Buffers handed to a single sendmsg() call (Linux IOV_MAX is 1024)
+MAX_IOV = 64
+
+# Codec ids live in the low bits of the header flags
+CODEC_MASK = 0x03
+CODECS = {
+    "zlib": (1, zlib.compress, zlib.decompressobj),
+    "bz2": (2, bz2.compress, bz2.BZ2Decompressor),
+    "lzma": (3, lzma.compress, lzma.LZMADecompressor),
+}
+CODEC_NAMES = {codec_id: name for name, (codec_id, *_) in CODECS.items()}
+COMPRESS_THRESHOLD = 4 << 10
+# Bounds each decompress() output chunk while inflating into the target
+INFLATE_CHUNK = 1 << 20
+
+_OOB_TYPES = {bytes: "bytes", bytearray: "bytearray", array.array: "array"}
+
+
+class _Pickler(pickle.Pickler):
+    # persistent_id() sees every object (reducer_override() skips bytes and
+    # bytearray); the PickleBuffer inside the id goes to buffer_callback
+    def persistent_id(self, obj):
+        kind = _OOB_TYPES.get(type(obj))
+        if kind is None:
+            return None
+        if kind == "array":
+            if len(obj) * obj.itemsize < OOB_THRESHOLD:
+                return None
+            return (kind, obj.typecode, sys.byteorder, pickle.PickleBuffer(obj))
+        if len(obj) < OOB_THRESHOLD:
+            return None
+        return (kind, pickle.PickleBuffer(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        kind, *info, buf = pid
+        if kind == "bytearray":
+            # The receive buffer itself: no copy
+            return buf if type(buf) is bytearray else bytearray(buf)
+        if kind == "bytes":
+            return bytes(buf)
+        if kind == "array":
+            typecode, byteorder = info
+            arr = array.array(typecode)
+            arr.frombytes(buf)
+            if byteorder != sys.byteorder:
+                arr.byteswap()
+            return arr
+        raise pickle.UnpicklingError(f"unknown persistent id {kind!r}")
+
+
+def dumps(obj):
+    # Returns (pickle stream, out-of-band buffers) without copying the buffers
+    buffers = []
+    stream = io.BytesIO()
+    _Pickler(stream, protocol=5, buffer_callback=buffers.append).dump(obj)
+    if len(buffers) > MAX_BUFFERS:
+        return pickle.dumps(obj, protocol=5), []
+    return stream.getbuffer(), [buf.raw() for buf in buffers]
+
+
+def loads(payload, buffers=()):
+    if not buffers:
+        return pickle.loads(payload)
+    return _Unpickler(io.BytesIO(payload), buffers=buffers).load()
+
+
+class Stats:
+    """Bytes and CPU time spent on one direction of a connection."""
+
+    def __init__(self):
+        self.msgs = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.cpu_time = 0.0
+
+    def record(self, raw_bytes, wire_bytes, cpu_time, compressed):
+        self.msgs += 1
+        self.compressed += compressed
+        self.raw_bytes += raw_bytes
+        self.wire_bytes += wire_bytes
+        self.cpu_time += cpu_time
+
+    def __str__(self):
+        ratio = self.raw_bytes / self.wire_bytes if self.wire_bytes else 1
+        return (
+            f"{self.msgs} msgs ({self.compressed} compressed), "
+            f"{self.raw_bytes:,} bytes -> {self.wire_bytes:,} on the wire, "
+            f"ratio {ratio:.2f}, codec cpu {self.cpu_time * 1000:.1f} ms"
+        )
+
+
+class Compression:
+    """What this end of a connection may compress with, and what it cost."""
+
+    def __init__(self, codec=None, threshold=COMPRESS_THRESHOLD):
+        self.codec = codec
+        self.threshold = threshold
+        self.sent = Stats()
+
+
+def handshake(sock, codecs, buffer_size=65536):
+    # Client side: offer codecs (in order of preference), get the server's pick
+    send_msg(sock, {"version": VERSION, "codecs": list(codecs)})
+    reply = read_msg(sock, buffer_size)
+    return Compression(reply["codec"], reply["threshold"])
+
+
+def accept_handshake(hello, codecs, threshold=COMPRESS_THRESHOLD):
+    # Server side: first of our codecs the client also offered (or None)
+    offered = hello.get("codecs", []) if isinstance(hello, dict) else []
+    codec = next((c for c in codecs if c in offered and c in CODECS), None)
+    return Compression(codec, threshold), {"codec": codec, "threshold": threshold}
+
+
+def build_frame(pickled, compression=None):
+    # Returns (frame, raw bytes, wire bytes, codec cpu seconds, compressed?)
+    payload, buffers = pickled
+    segments = [payload, *buffers]
+    raw_lens = [memoryview(seg).nbytes for seg in segments]
+    raw_total, cpu, flags = sum(raw_lens), 0.0, 0
+    if compression and compression.codec and raw_total >= compression.threshold:
+        codec_id, compress, _ = CODECS[compression.codec]
+        start = time.thread_time()
+        packed = [compress(seg) for seg in segments]
+        cpu = time.thread_time() - start
+        # Not worth it if it doesn't shrink (already compressed data)
+        if sum(len(seg) for seg in packed) < raw_total:
+            segments, flags = packed, codec_id
+
+    wire_lens = [memoryview(seg).nbytes for seg in segments]
+    tables = wire_lens[1:] + (raw_lens if flags else [])
+    header = HEADER.pack(VERSION, flags, len(buffers), wire_lens[0])
+    frame = [header, struct.pack(f"!{len(tables)}Q", *tables), *segments]
+    wire_total = HEADER.size + 8 * len(tables) + sum(wire_lens)
+    return frame, raw_total, wire_total, cpu, bool(flags)
+
+
+def frame_msg(obj, compression=None):
+    # List of buffers making up one frame, ready for sendmsg()
+    frame, *info = build_frame(dumps(obj), compression)
+    if compression:
+        compression.sent.record(*info)
+    return frame
+
+
+class SendQueue:
+    """Frames waiting to go out, written with scatter/gather sendmsg()."""
+
+    def __init__(self):
+        self.views = collections.deque()
+        self.nbytes = 0
+
+    def __bool__(self):
+        return bool(self.views)
+
+    def push(self, frame):
+        for buf in frame:
+            view = memoryview(buf).cast("B")
+            if view.nbytes:
+                self.views.append(view)
+                self.nbytes += view.nbytes
+
+    def send(self, sock):
+        # One sendmsg(); a partial send leaves the remainder at the front
+        sent = sock.sendmsg(list(itertools.islice(self.views, MAX_IOV)))
+        self.consume(sent)
+        return sent
+
+    def consume(self, sent):
+        # Drop the first `sent` bytes
+        self.nbytes -= sent
+        while sent:
+            head = self.views[0]
+            if sent >= head.nbytes:
+                sent -= head.nbytes
+                self.views.popleft()
+            else:
+                self.views[0] = head[sent:]
+                sent = 0
+
+
+def send_frame(sock, frame):
+    # Usually one sendmsg() takes the whole frame; queue up whatever it didn't
+    sent = 0
+    if len(frame) <= MAX_IOV:
+        sent = sock.sendmsg(frame)
+        if sent == sum(memoryview(buf).nbytes for buf in frame):
+            return
+    queue = SendQueue()
+    queue.push(frame)
+    queue.consume(sent)
+    while queue:
+        queue.send(sock)
+
+
+def send_msg(sock, obj, compression=None):
+    send_frame(sock, frame_msg(obj, compression))
+
+
+class _Inflater:
+    """Decompresses one segment, chunk by chunk, into its final bytearray."""
+
+    def __init__(self, codec_id, target):
+        self.decompressor = CODECS[CODEC_NAMES[codec_id]][2]()
+        self.view = memoryview(target)
+        self.pos = 0
+
+    def _put(self, out):
+        self.view[self.pos : self.pos + len(out)] = out
+        self.pos += len(out)
+
+    def feed(self, data):
+        d = self.decompressor
+        while True:
+            self._put(d.decompress(data, INFLATE_CHUNK))
+            if hasattr(d, "unconsumed_tail"):
+                # zlib keeps input it had no room to inflate
+                data = d.unconsumed_tail
+                if not data:
+                    return
+            elif d.needs_input or d.eof:
+                return
+            else:
+                data = b""
+
+    def finish(self):
+        if hasattr(self.decompressor, "flush"):
+            self._put(self.decompressor.flush())
+        if self.pos != len(self.view):
+            raise ValueError("compressed segment has the wrong size")
+
+
+class MsgReader:
+    """Incremental frame decoder that receives straight into its buffers.
+
+    recv_into(reader.view()) then reader.advance(n); once advance() returns
+    True, reader.message() gives the object. recv() does the same for
+    non-blocking sockets. Compressed segments are received a chunk at a time
+    and inflated directly into their final buffer.
+    """
+
+    def __init__(self, buffer_size=65536, stats=None):
+        self.buffer_size = buffer_size
+        self.stats = stats if stats is not None else Stats()
+        self.scratch = None
+        self.eof = False
+        self._reset()
+
+    def _reset(self):
+        self.stage = "header"
+        self.flags = 0
+        self.wire_lens = ()
+        self.raw_lens = ()
+        self.segments = []
+        self.wire_bytes = 0
+        self.cpu_time = 0.0
+        self._expect(HEADER.size)
+
+    def _expect(self, size, raw_size=None):
+        # Raw segments are received in place; compressed ones via scratch
+        self.target = bytearray(size if raw_size is None else raw_size)
+        self._view = memoryview(self.target)
+        self.inflater = None
+        if raw_size is not None:
+            self.inflater = _Inflater(self.flags & CODEC_MASK, self.target)
+            if self.scratch is None:
+                self.scratch = memoryview(bytearray(self.buffer_size))
+        self.pos = 0
+        self.remaining = size
+
+    def view(self):
+        size = min(self.buffer_size, self.remaining)
+        if self.inflater:
+            return self.scratch[:size]
+        return self._view[self.pos : self.pos + size]
+
+    def advance(self, n):
+        self.wire_bytes += n
+        self.remaining -= n
+        if self.inflater:
+            start = time.thread_time()
+            self.inflater.feed(self.scratch[:n])
+            if not self.remaining:
+                self.inflater.finish()
+            self.cpu_time += time.thread_time() - start
+        else:
+            self.pos += n
+        while not self.remaining:
+            if self._next_stage():
+                return True
+        return False
+
+    def _next_stage(self):
+        # Move on to the next part of the frame; True once the frame is whole
+        if self.stage == "header":
+            version, self.flags, n_buffers, payload_len = HEADER.unpack(self.target)
+            if version != VERSION:
+                raise ValueError(f"unsupported frame version {version}")
+            self.wire_lens = (payload_len,)
+            n_lengths = n_buffers + (n_buffers + 1 if self.flags else 0)
+            self.stage = "lengths"
+            if n_lengths:
+                self._expect(8 * n_lengths)
+                return False
+            self.stage = "segments"
+        elif self.stage == "lengths":
+            tables = struct.unpack(f"!{len(self.target) // 8}Q", self.target)
+            n_buffers = (len(tables) - 1) // 2 if self.flags else len(tables)
+            self.wire_lens += tables[:n_buffers]
+            self.raw_lens = tables[n_buffers:]
+            self.stage = "segments"
+        else:
+            self.segments.append(self.target)
+        i = len(self.segments)
+        if i == len(self.wire_lens):
+            return True
+        if self.flags:
+            self._expect(self.wire_lens[i], self.raw_lens[i])
+        else:
+            self._expect(self.wire_lens[i])
+        return False
+
+    def message(self):
+        payload, *buffers = self.segments
+        raw_bytes = sum(len(seg) for seg in self.segments)
+        info = (raw_bytes, self.wire_bytes, self.cpu_time, bool(self.flags))
+        self._reset()
+        self.stats.record(*info)
+        return loads(payload, buffers)
+
+    def recv(self, sock):
+        # Returns every message completed by the data currently available
+        msgs = []
+        while not self.eof:
+            try:
+                n = sock.recv_into(self.view())
+            except (BlockingIOError, InterruptedError):
+                break
+            if n == 0:
+                self.eof = True
+                break
+            if self.advance(n):
+                msgs.append(self.message())
+        return msgs
+
+
+def read_msg(sock, buffer_size=65536, stats=None):
+    reader = MsgReader(buffer_size, stats)
+    while True:
+        n = sock.recv_into(reader.view())
+        if n == 0:
+            raise ConnectionError("socket closed mid-message")
+        if reader.advance(n):
+            return reader.message()
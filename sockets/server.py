@@ -1,18 +1,51 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import functools
 import logging
-import pickle
+import selectors
 import socket
+import threading
 
-
-HEADER_SIZE = 20
+from protocol import (
+    CODECS,
+    COMPRESS_THRESHOLD,
+    MsgReader,
+    SendQueue,
+    accept_handshake,
+    build_frame,
+    dumps,
+    read_msg,
+    send_msg,
+)
 
 
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument("IPv4", help="IPv4 address to bind")
     parser.add_argument("PORT", help="port number to bind", type=int)
+    parser.add_argument(
+        "-m",
+        "--multi",
+        help="serve many clients at once (selectors event loop)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-c",
+        "--compress",
+        help="codecs clients may use, in order of preference",
+        nargs="+",
+        default=[],
+        choices=CODECS,
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        help="send messages smaller than this (bytes) uncompressed",
+        default=COMPRESS_THRESHOLD,
+        type=int,
+    )
     parser.add_argument(
         "-q", "--quiet", help="only show warnings and errors", action="store_true"
     )
@@ -24,33 +57,288 @@ def cli():
     return args
 
 
-def send_msg(sock, obj):
-    ser_obj = pickle.dumps(obj)
-    header = f"{len(ser_obj): <{HEADER_SIZE}}"
-    full_msg = bytes(header, "utf-8") + ser_obj
-    sock.send(full_msg)
+class Connection:
+    """A client socket, its partially read message and its pending frames."""
 
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.reader = MsgReader()
+        self.queue = SendQueue()
+        # Set by the handshake; nothing is sent to the client before that
+        self.compression = None
+        self.sent_msgs = 0
 
-def main():
-    args = cli()
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    address_port = (args.IPv4, args.PORT)
-    logging.info(f"Binding socket to {address_port}...")
-    s.bind(address_port)
-    logging.info(f"Server is listening...")
-    s.listen()
+    def push(self, frame):
+        self.queue.push(frame)
+        self.sent_msgs += 1
+
+    def flush(self):
+        # Write as much as the socket accepts; True once the queue is empty
+        while self.queue:
+            try:
+                self.queue.send(self.sock)
+            except (BlockingIOError, InterruptedError):
+                return False
+        return True
+
+
+class EventServer:
+    """Serves any number of clients from one thread with selectors.
+
+    Other threads deliver messages through send_to()/broadcast(): objects are
+    pickled by the caller, queued per connection and written whenever the
+    client's socket is writable, so one slow client never blocks the rest.
+    Each client's first message is its handshake, which picks its codec.
+    """
+
+    def __init__(
+        self,
+        address_port,
+        codecs=(),
+        threshold=COMPRESS_THRESHOLD,
+        backlog=4096,
+        max_queue=64 << 20,
+    ):
+        self.codecs = codecs
+        self.threshold = threshold
+        self.max_queue = max_queue
+        self.selector = selectors.DefaultSelector()
+        self.listener = socket.create_server(address_port, backlog=backlog)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ, self._accept)
+
+        # Commands from other threads run on the loop thread (after a wakeup)
+        self.commands = collections.deque()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, self._wakeup)
+
+        self.connections = {}
+        self.running = False
+
+    @property
+    def address(self):
+        return self.listener.getsockname()
+
+    def send_to(self, address, obj):
+        self._call(self._deliver, [address], dumps(obj))
+
+    def broadcast(self, obj):
+        # Pickled once (compressed once per codec), shared by every queue
+        self._call(self._deliver, None, dumps(obj))
+
+    def close_client(self, address):
+        self._call(self._close_address, address)
+
+    def stop(self):
+        self._call(setattr, self, "running", False)
 
+    def serve_forever(self):
+        self.running = True
+        try:
+            while self.running:
+                for key, mask in self.selector.select():
+                    key.data(key.fileobj, mask)
+        finally:
+            for conn in list(self.connections.values()):
+                self._close(conn)
+            self.selector.close()
+            self.listener.close()
+            self._wake_r.close()
+            self._wake_w.close()
+
+    def handle_connect(self, conn):
+        # Hook: runs on the loop thread once a new client's handshake is done
+        self._deliver([conn.address], dumps(f"Connected to {self.address}"))
+
+    def handle_message(self, conn, obj):
+        # Hook: runs on the loop thread for each message a client sends
+        logging.info(f"{conn.address[0]}:{conn.address[1]} > {obj}")
+
+    def handle_close(self, conn):
+        # Hook: runs on the loop thread after a client is gone
+        pass
+
+    def _call(self, func, *args):
+        self.commands.append((func, args))
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            # Wakeup already pending
+            pass
+
+    def _wakeup(self, sock, mask):
+        try:
+            while sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.commands:
+            func, args = self.commands.popleft()
+            func(*args)
+
+    def _accept(self, listener, mask):
+        # Drain the backlog: many clients may connect between two selects
+        for _ in range(256):
+            try:
+                client_socket, address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            client_socket.setblocking(False)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(client_socket, address)
+            self.connections[address] = conn
+            self.selector.register(
+                client_socket, selectors.EVENT_READ, functools.partial(self._io, conn)
+            )
+            logging.info(f"Connection from {address} established!")
+
+    def _io(self, conn, sock, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                msgs = conn.reader.recv(sock)
+            except (ConnectionError, ValueError):
+                self._close(conn)
+                return
+            for msg in msgs:
+                if conn.compression is None:
+                    self._handshake(conn, msg)
+                else:
+                    self.handle_message(conn, msg)
+            if conn.reader.eof:
+                self._close(conn)
+                return
+        if mask & selectors.EVENT_WRITE and conn.address in self.connections:
+            self._flush(conn)
+
+    def _handshake(self, conn, hello):
+        conn.compression, reply = accept_handshake(hello, self.codecs, self.threshold)
+        logging.info(f"{conn.address} will receive codec {conn.compression.codec}")
+        conn.push(build_frame(dumps(reply))[0])
+        self._flush(conn)
+        self.handle_connect(conn)
+
+    def _deliver(self, addresses, pickled):
+        if addresses is None:
+            conns = list(self.connections.values())
+        else:
+            conns = [self.connections[a] for a in addresses if a in self.connections]
+        frames = {}
+        for conn in conns:
+            compression = conn.compression
+            if compression is None:
+                continue
+            # Compress once per (codec, threshold); only the first pays cpu
+            key = (compression.codec, compression.threshold)
+            if key in frames:
+                frame, raw, wire, _, compressed = frames[key]
+                compression.sent.record(raw, wire, 0.0, compressed)
+            else:
+                frames[key] = build_frame(pickled, compression)
+                frame = frames[key][0]
+                compression.sent.record(*frames[key][1:])
+            # Already waiting for EVENT_WRITE: just queue behind it
+            waiting = bool(conn.queue)
+            conn.push(frame)
+            if conn.queue.nbytes > self.max_queue:
+                logging.warning(f"{conn.address} is too slow, disconnecting")
+                self._close(conn)
+            elif not waiting:
+                self._flush(conn)
+
+    def _flush(self, conn):
+        try:
+            drained = conn.flush()
+        except OSError:
+            self._close(conn)
+            return
+        events = selectors.EVENT_READ
+        if not drained:
+            events |= selectors.EVENT_WRITE
+        key = self.selector.get_key(conn.sock)
+        if key.events != events:
+            self.selector.modify(conn.sock, events, key.data)
+
+    def _close_address(self, address):
+        if address in self.connections:
+            self._close(self.connections[address])
+
+    def _close(self, conn):
+        if self.connections.pop(conn.address, None) is None:
+            return
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        logging.info(f"Connection from {conn.address} closed")
+        if conn.compression is not None:
+            logging.info(f"{conn.address} sent: {conn.compression.sent}")
+        self.handle_close(conn)
+
+
+def serve_one(s, address_port, codecs, threshold):
     while True:
         client_socket, address = s.accept()
         logging.info(f"Connection from {address} established!")
-        send_msg(client_socket, f"Connection to {address_port} established!")
+        hello = read_msg(client_socket)
+        compression, reply = accept_handshake(hello, codecs, threshold)
+        send_msg(client_socket, reply)
+        logging.info(f"{address} will receive codec {compression.codec}")
+        msg = f"Connection to {address_port} established!"
+        send_msg(client_socket, msg, compression)
 
         prompt = f"send to {address[0]}:{address[1]} > "
         msg = input(prompt)
         while msg.lower() != "close":
-            send_msg(client_socket, msg)
+            send_msg(client_socket, msg, compression)
             msg = input(prompt)
         client_socket.close()
+        logging.info(f"{address} sent: {compression.sent}")
+
+
+def serve_many(address_port, codecs, threshold):
+    # stdin drives the same API other code would call:
+    #   'msg' broadcasts, '@host:port msg' targets one client,
+    #   '@host:port close' drops it, 'close' stops the server
+    server = EventServer(address_port, codecs, threshold)
+    loop = threading.Thread(target=server.serve_forever)
+    loop.start()
+    logging.info(f"Server is listening on {server.address}...")
+    try:
+        for line in iter(lambda: input("send > "), "close"):
+            if line.startswith("@") and " " in line:
+                target, msg = line[1:].split(" ", 1)
+                host, _, port = target.rpartition(":")
+                if not host or not port.isdigit():
+                    # A typo mustn't take the server down
+                    logging.error(f"Bad target {target!r}: expected @host:port")
+                    continue
+                if msg.lower() == "close":
+                    server.close_client((host, int(port)))
+                else:
+                    server.send_to((host, int(port)), msg)
+            else:
+                server.broadcast(line)
+    except EOFError:
+        pass
+    finally:
+        server.stop()
+        loop.join()
+
+
+def main():
+    args = cli()
+    address_port = (args.IPv4, args.PORT)
+    if args.multi:
+        serve_many(address_port, args.compress, args.threshold)
+        return
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    logging.info(f"Binding socket to {address_port}...")
+    s.bind(address_port)
+    logging.info(f"Server is listening...")
+    s.listen()
+    serve_one(s, address_port, args.compress, args.threshold)
 
 
 if __name__ == "__main__":